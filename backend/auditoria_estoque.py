@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Auditoria de consistência do estoque via linha de comando
+
+Uso: python auditoria_estoque.py --paralelismo 8 [--corrigir]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+
+from server import auditar_estoque, conectar_banco, fechar_banco
+
+
+async def main(args):
+    conectar_banco()
+    try:
+        resultado = await auditar_estoque(
+            paralelismo=args.paralelismo,
+            corrigir=args.corrigir,
+            limite_divergencias=args.limite_divergencias,
+        )
+    finally:
+        fechar_banco()
+
+    print(json.dumps(resultado.dict(), indent=2, ensure_ascii=False))
+    return 0 if resultado.total_divergencias == 0 else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica o livro de movimentações contra os saldos dos produtos")
+    parser.add_argument("--paralelismo", type=int, default=4, help="Faixas de produto_id auditadas em paralelo")
+    parser.add_argument("--corrigir", action="store_true", help="Grava movimentações de AJUSTE para saldos divergentes")
+    parser.add_argument("--limite-divergencias", type=int, default=100, help="Máximo de divergências listadas")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Gerador determinístico de dados sintéticos para testes de escala
+
+Com a mesma semente e os mesmos parâmetros, gera sempre o mesmo catálogo e o
+mesmo livro de movimentações. O volume de movimentações por produto segue uma distribuição
+de Zipf (poucos produtos concentram a maior parte das vendas). Cada produto
+tem uma cadeia quantidade_anterior/quantidade_nova consistente, nunca fica
+negativo e termina com quantidade_atual igual ao saldo do livro, então a
+auditoria de estoque passa sem divergências.
+
+Uso:
+    python gerar_dados.py --produtos 500000 --movimentacoes 50000000 --semente 42
+    python gerar_dados.py --produtos 1000 --movimentacoes 100000 --destino jsonl --saida /tmp/estoque
+"""
+
+import abc
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from server import MotivoMovimentacao, OrigemPreco, TipoMovimentacao, UnidadeMedida
+
+# categoria -> (unidades possíveis, faixa de preço de compra, itens)
+CATEGORIAS = {
+    "Alimentos": ([UnidadeMedida.PACOTE, UnidadeMedida.KG, UnidadeMedida.UNIDADE], (2.0, 60.0),
+                  ["Arroz", "Feijão", "Macarrão", "Açúcar", "Café", "Farinha", "Óleo", "Sal"]),
+    "Bebidas": ([UnidadeMedida.LITRO, UnidadeMedida.UNIDADE, UnidadeMedida.CAIXA], (1.5, 45.0),
+                ["Água", "Refrigerante", "Suco", "Cerveja", "Leite", "Chá"]),
+    "Padaria": ([UnidadeMedida.UNIDADE, UnidadeMedida.KG], (0.5, 25.0),
+                ["Pão Francês", "Pão de Forma", "Bolo", "Biscoito", "Torrada"]),
+    "Hortifruti": ([UnidadeMedida.KG, UnidadeMedida.UNIDADE], (1.0, 20.0),
+                   ["Banana", "Tomate", "Batata", "Cebola", "Alface", "Maçã"]),
+    "Limpeza": ([UnidadeMedida.UNIDADE, UnidadeMedida.LITRO, UnidadeMedida.CAIXA], (2.0, 40.0),
+                ["Detergente", "Sabão em Pó", "Desinfetante", "Esponja", "Água Sanitária"]),
+    "Higiene": ([UnidadeMedida.UNIDADE, UnidadeMedida.PACOTE], (2.0, 35.0),
+                ["Sabonete", "Shampoo", "Creme Dental", "Papel Higiênico", "Desodorante"]),
+    "Ferragens": ([UnidadeMedida.UNIDADE, UnidadeMedida.METRO, UnidadeMedida.CAIXA], (0.5, 120.0),
+                  ["Parafuso", "Cabo Elétrico", "Mangueira", "Prego", "Fita Isolante"]),
+}
+MARCAS = ["Bom Dia", "Da Casa", "Estrela", "Ideal", "Premium", "Popular", "Vale Verde", "Sol"]
+
+# (tipo, motivo, probabilidade)
+MIX_MOVIMENTACOES = [
+    (TipoMovimentacao.SAIDA, MotivoMovimentacao.VENDA, 0.70),
+    (TipoMovimentacao.ENTRADA, MotivoMovimentacao.COMPRA, 0.20),
+    (TipoMovimentacao.SAIDA, MotivoMovimentacao.PERDA, 0.03),
+    (TipoMovimentacao.ENTRADA, MotivoMovimentacao.DEVOLUCAO, 0.03),
+    (TipoMovimentacao.ENTRADA, MotivoMovimentacao.AJUSTE, 0.02),
+    (TipoMovimentacao.SAIDA, MotivoMovimentacao.AJUSTE, 0.02),
+]
+# Compras repõem lotes maiores que as saídas unitárias
+MULTIPLICADOR_ENTRADA = {MotivoMovimentacao.COMPRA: 12, MotivoMovimentacao.DEVOLUCAO: 1, MotivoMovimentacao.AJUSTE: 2}
+
+INICIO = datetime(2025, 1, 1)
+
+
+def gerar_uuids(rng: np.random.Generator, total: int) -> list:
+    # UUID4 vetorizado: bytes aleatórios com os bits de versão e variante ajustados
+    dados = np.frombuffer(rng.bytes(16 * total), dtype=np.uint8).reshape(total, 16).copy()
+    dados[:, 6] = (dados[:, 6] & 0x0F) | 0x40
+    dados[:, 8] = (dados[:, 8] & 0x3F) | 0x80
+    texto = dados.tobytes().hex()
+    return [
+        f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+        for h in (texto[i:i + 32] for i in range(0, len(texto), 32))
+    ]
+
+
+def gerar_catalogo(rng: np.random.Generator, total: int):
+    """Devolve os atributos do catálogo em arrays (um elemento por produto)."""
+    nomes_categorias = list(CATEGORIAS)
+    categorias = rng.integers(0, len(nomes_categorias), total)
+    catalogo = {
+        "id": gerar_uuids(rng, total),
+        "categoria": [nomes_categorias[c] for c in categorias],
+        "unidade_medida": [],
+        "nome": [],
+        "preco_compra": np.empty(total),
+        "created_at": [INICIO - timedelta(minutes=int(m)) for m in rng.integers(0, 60 * 24 * 30, total)],
+    }
+    marcas = rng.integers(0, len(MARCAS), total)
+    for i, c in enumerate(categorias):
+        unidades, (preco_min, preco_max), itens = CATEGORIAS[nomes_categorias[c]]
+        catalogo["unidade_medida"].append(unidades[rng.integers(0, len(unidades))])
+        # O sufixo numérico garante nomes únicos, como exige o cadastro
+        catalogo["nome"].append(f"{itens[rng.integers(0, len(itens))]} {MARCAS[marcas[i]]} {i:07d}")
+        catalogo["preco_compra"][i] = round(float(rng.uniform(preco_min, preco_max)), 2)
+    catalogo["preco_venda"] = np.round(catalogo["preco_compra"] * rng.uniform(1.15, 1.6, total), 2)
+    catalogo["quantidade_minima"] = rng.integers(0, 20, total).astype(float)
+    return catalogo
+
+
+def distribuir_movimentacoes(rng: np.random.Generator, produtos: int, movimentacoes: int, expoente: float):
+    # Zipf: o produto de posição k recebe peso 1/k^s; as posições são embaralhadas
+    pesos = 1.0 / np.arange(1, produtos + 1) ** expoente
+    pesos = pesos[rng.permutation(produtos)]
+    return rng.multinomial(movimentacoes, pesos / pesos.sum())
+
+
+def gerar_livro(rng: np.random.Generator, contagens: np.ndarray, fracionado: np.ndarray, dias: int):
+    """Gera as movimentações de um bloco de produtos de forma vetorizada.
+
+    Devolve (indice_produto, indice_mix, quantidade, anterior, nova, milissegundos, inicial):
+    `inicial` é o saldo de abertura de cada produto, escolhido para que a cadeia nunca fique negativa,
+    e `milissegundos` (desde INICIO) é estritamente crescente dentro de cada produto.
+    """
+    total = int(contagens.sum())
+    produto = np.repeat(np.arange(len(contagens)), contagens)
+    probabilidades = np.array([p for _, _, p in MIX_MOVIMENTACOES])
+    mix = rng.choice(len(MIX_MOVIMENTACOES), total, p=probabilidades / probabilidades.sum())
+    entrada = np.array([t == TipoMovimentacao.ENTRADA for t, _, _ in MIX_MOVIMENTACOES])[mix]
+    multiplicador = np.array([MULTIPLICADOR_ENTRADA.get(m, 1) if t == TipoMovimentacao.ENTRADA else 1
+                              for t, m, _ in MIX_MOVIMENTACOES])[mix]
+
+    base = rng.geometric(0.35, total).astype(float)
+    fracao = fracionado[produto]
+    base[fracao] = np.round(rng.gamma(2.0, 0.6, int(fracao.sum())) + 0.05, 3)
+    quantidade = base * multiplicador
+    delta = np.where(entrada, quantidade, -quantidade)
+
+    # Ordem cronológica dentro de cada produto
+    segundos = rng.integers(0, dias * 86400, total)
+    ordem = np.lexsort((segundos, produto))
+    produto, mix, quantidade, delta, segundos = produto[ordem], mix[ordem], quantidade[ordem], delta[ordem], segundos[ordem]
+    inicios = np.concatenate(([0], np.cumsum(contagens)[:-1]))
+
+    # Horários em milissegundos (a precisão do MongoDB) estritamente crescentes por produto:
+    # com a posição p no produto, o máximo acumulado de (t - p) somado de volta a p só
+    # empurra para frente os horários empatados. O deslocamento por produto isola os máximos.
+    posicao = np.arange(total) - np.repeat(inicios, contagens)
+    deslocamento = np.repeat(np.arange(len(contagens), dtype=np.int64), contagens) * (2 * dias * 86400 * 1000 + total)
+    milissegundos = segundos.astype(np.int64) * 1000 - posicao + deslocamento
+    milissegundos = np.maximum.accumulate(milissegundos) + posicao - deslocamento
+
+    # Soma acumulada por produto: cumsum global menos o acumulado antes de cada produto
+    acumulado = np.cumsum(delta)
+    antes = np.concatenate(([0.0], acumulado))[inicios]
+    acumulado -= np.repeat(antes, contagens)
+
+    minimo = np.zeros(len(contagens))
+    com_movimentos = contagens > 0
+    minimo[com_movimentos] = np.minimum.reduceat(acumulado, inicios[com_movimentos])
+    inicial = np.ceil(np.maximum(0, -minimo)) + rng.integers(0, 50, len(contagens))
+
+    nova = np.round(acumulado + np.repeat(inicial, contagens), 3)
+    anterior = np.round(nova - delta, 3)
+    return produto, mix, quantidade, anterior, nova, milissegundos, inicial
+
+
+def documentos_produto(catalogo, indices, inicial, nova_final, sequencias):
+    for j, i in enumerate(indices):
+        yield {
+            "id": catalogo["id"][i],
+            "nome": catalogo["nome"][i],
+            "categoria": catalogo["categoria"][i],
+            "unidade_medida": catalogo["unidade_medida"][i].value,
+            "quantidade_atual": float(nova_final[j]),
+            "quantidade_minima": float(catalogo["quantidade_minima"][i]),
+            "preco_compra": float(catalogo["preco_compra"][i]),
+            "preco_venda": float(catalogo["preco_venda"][i]),
+            "codigo_barras": f"789{int(i):010d}",
+            "ativo": True,
+            "faixas_estoque": 0,
+            "quantidade_reservada": 0.0,
+            "usa_depositos": False,
+            "seq_movimentacoes": int(sequencias[j]),
+            "created_at": catalogo["created_at"][i],
+            "updated_at": catalogo["created_at"][i],
+        }
+
+
+COLECOES_LIMPAR = ("produtos", "movimentacoes", "historico_precos", "estoques", "estoque_faixas", "reservas")
+
+
+class Destino(abc.ABC):
+    @abc.abstractmethod
+    def gravar(self, colecao: str, documentos: list):
+        ...
+
+    def fechar(self):
+        pass
+
+
+class DestinoMongo(Destino):
+    def __init__(self, escritores: int, limpar: bool):
+        from pymongo import MongoClient
+
+        self.client = MongoClient(os.environ["MONGO_URL"])
+        self.db = self.client[os.environ["DB_NAME"]]
+        if limpar:
+            # delete_many preserva os índices criados pelo server (drop apagaria junto).
+            # Saldos por depósito, faixas e reservas apontam para os produtos apagados.
+            for colecao in COLECOES_LIMPAR:
+                self.db[colecao].delete_many({})
+        self.escritores = escritores
+        self.executor = ThreadPoolExecutor(max_workers=escritores)
+        self.pendentes = []
+
+    def gravar(self, colecao, documentos):
+        # pymongo libera o GIL na rede, então vários lotes seguem em paralelo
+        self.pendentes.append(self.executor.submit(self.db[colecao].insert_many, documentos, ordered=False))
+        if len(self.pendentes) > 2 * self.escritores:
+            self.pendentes.pop(0).result()
+
+    def fechar(self):
+        for futuro in self.pendentes:
+            futuro.result()
+        self.executor.shutdown()
+        # Invalida ETags emitidas antes da carga
+        self.db.controle.update_one(
+            {"_id": "catalogo"},
+            {"$inc": {"versao": 1}, "$setOnInsert": {"geracao": uuid.uuid4().hex[:8]}},
+            upsert=True,
+        )
+        self.client.close()
+
+
+class DestinoJsonl(Destino):
+    """Grava um arquivo JSON Lines por coleção, compatível com mongoimport."""
+
+    def __init__(self, diretorio: Path):
+        self.encoder = json.JSONEncoder(ensure_ascii=False, default=self._data_estendida)
+        diretorio.mkdir(parents=True, exist_ok=True)
+        self.arquivos = {
+            colecao: open(diretorio / f"{colecao}.jsonl", "w", encoding="utf-8")
+            for colecao in ("produtos", "movimentacoes", "historico_precos")
+        }
+
+    def gravar(self, colecao, documentos):
+        encode = self.encoder.encode
+        self.arquivos[colecao].write("".join(encode(d) + "\n" for d in documentos))
+
+    @staticmethod
+    def _data_estendida(valor):
+        # Datas no formato Extended JSON ({"$date": ...}) que o mongoimport entende
+        if isinstance(valor, datetime):
+            return {"$date": valor.isoformat(timespec="milliseconds") + "Z"}
+        raise TypeError(f"Tipo não serializável: {type(valor)}")
+
+    def fechar(self):
+        for arquivo in self.arquivos.values():
+            arquivo.close()
+
+
+def gerar(args, destino: Destino):
+    rng = np.random.default_rng(args.semente)
+    catalogo = gerar_catalogo(rng, args.produtos)
+    contagens = distribuir_movimentacoes(rng, args.produtos, args.movimentacoes, args.zipf)
+    fracionado = np.array([u in (UnidadeMedida.KG, UnidadeMedida.LITRO, UnidadeMedida.METRO)
+                           for u in catalogo["unidade_medida"]])
+    tipos = [t.value for t, _, _ in MIX_MOVIMENTACOES]
+    motivos = [m.value for _, m, _ in MIX_MOVIMENTACOES]
+    id_movimentacao = np.random.default_rng([args.semente, 1])
+
+    gravadas = 0
+    inicio_execucao = time.perf_counter()
+    for bloco in range(0, args.produtos, args.produtos_por_bloco):
+        indices = np.arange(bloco, min(bloco + args.produtos_por_bloco, args.produtos))
+        produto, mix, quantidade, anterior, nova, milissegundos, inicial = gerar_livro(
+            rng, contagens[indices], fracionado[indices], args.dias
+        )
+        final = inicial.copy()
+        com_movimentos = contagens[indices] > 0
+        final[com_movimentos] = nova[np.cumsum(contagens[indices])[com_movimentos] - 1]
+
+        # seq da cadeia global, como o server grava: a INICIAL (se houver) é 1
+        com_inicial = (inicial > 0).astype(np.int64)
+        inicios = np.concatenate(([0], np.cumsum(contagens[indices])[:-1]))
+        seq = np.arange(len(produto)) - np.repeat(inicios, contagens[indices]) + 1 + com_inicial[produto]
+        sequencias = contagens[indices] + com_inicial
+
+        destino.gravar("produtos", list(documentos_produto(catalogo, indices, inicial, final, sequencias)))
+        destino.gravar("historico_precos", [
+            {
+                "id": id_historico,
+                "produto_id": catalogo["id"][i],
+                "preco_compra": float(catalogo["preco_compra"][i]),
+                "preco_venda": float(catalogo["preco_venda"][i]),
+                "origem": OrigemPreco.CADASTRO.value,
+                "usuario": "Gerador",
+                "vigente_desde": catalogo["created_at"][i],
+            }
+            for i, id_historico in zip(indices, gerar_uuids(id_movimentacao, len(indices)))
+        ])
+        destino.gravar("movimentacoes", [
+            {
+                "id": id_inicial,
+                "produto_id": catalogo["id"][i],
+                "tipo": TipoMovimentacao.ENTRADA.value,
+                "motivo": MotivoMovimentacao.INICIAL.value,
+                "quantidade": float(inicial[j]),
+                "quantidade_anterior": 0.0,
+                "quantidade_nova": float(inicial[j]),
+                "preco_unitario": float(catalogo["preco_compra"][i]),
+                "usuario": "Gerador",
+                "seq": 1,
+                "created_at": catalogo["created_at"][i],
+            }
+            for (j, i), id_inicial in zip(enumerate(indices), gerar_uuids(id_movimentacao, len(indices)))
+            if inicial[j] > 0
+        ])
+
+        for lote in range(0, len(produto), args.lote):
+            fatia = slice(lote, lote + args.lote)
+            documentos = []
+            ids = gerar_uuids(id_movimentacao, len(produto[fatia]))
+            for id_mov, p, m, q, a, n, ms, sq in zip(ids, produto[fatia].tolist(), mix[fatia].tolist(),
+                                                     quantidade[fatia].tolist(), anterior[fatia].tolist(),
+                                                     nova[fatia].tolist(), milissegundos[fatia].tolist(),
+                                                     seq[fatia].tolist()):
+                i = indices[p]
+                entrada = tipos[m] == TipoMovimentacao.ENTRADA.value
+                documentos.append({
+                    "id": id_mov,
+                    "produto_id": catalogo["id"][i],
+                    "tipo": tipos[m],
+                    "motivo": motivos[m],
+                    "quantidade": q,
+                    "quantidade_anterior": a,
+                    "quantidade_nova": n,
+                    "preco_unitario": float(catalogo["preco_compra"][i] if entrada else catalogo["preco_venda"][i]),
+                    "usuario": "Gerador",
+                    "seq": sq,
+                    "created_at": INICIO + timedelta(milliseconds=ms),
+                })
+            destino.gravar("movimentacoes", documentos)
+            gravadas += len(documentos)
+
+        decorrido = time.perf_counter() - inicio_execucao
+        print(f"{indices[-1] + 1}/{args.produtos} produtos, {gravadas} movimentações "
+              f"({gravadas / decorrido:,.0f}/s)", file=sys.stderr)
+    destino.fechar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera catálogo e movimentações sintéticos e reproduzíveis")
+    parser.add_argument("--produtos", type=int, default=10000)
+    parser.add_argument("--movimentacoes", type=int, default=1000000, help="Movimentações além das iniciais")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Expoente da distribuição de volume por produto")
+    parser.add_argument("--dias", type=int, default=365, help="Período coberto pelas movimentações")
+    parser.add_argument("--destino", choices=["mongo", "jsonl"], default="mongo")
+    parser.add_argument("--saida", type=Path, default=Path("dados_sinteticos"), help="Diretório do destino jsonl")
+    parser.add_argument("--lote", type=int, default=10000, help="Documentos por insert_many")
+    parser.add_argument("--produtos-por-bloco", type=int, default=10000)
+    parser.add_argument("--escritores", type=int, default=4, help="Inserções simultâneas no Mongo")
+    parser.add_argument("--limpar", action="store_true",
+                        help="Apaga produtos, movimentações, histórico, depósitos por produto, faixas e reservas antes")
+    args = parser.parse_args()
+
+    if args.destino == "mongo":
+        destino = DestinoMongo(args.escritores, args.limpar)
+    else:
+        destino = DestinoJsonl(args.saida)
+    gerar(args, destino)
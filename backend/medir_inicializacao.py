@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Mede o custo de importação do server.py com `python -X importtime`
+
+O custo é comparado com a linha de base registrada em tests/linha_base_inicializacao.json
+como razão entre a importação do server e a do fastapi, que é obrigatória: assim o
+número não depende da máquina. O mesmo critério roda no pytest (tests/test_inicializacao.py).
+
+Falha (código 1) se a razão passar da linha de base mais a tolerância ou se algum
+módulo pesado, que só deve ser carregado sob demanda, for importado na inicialização.
+
+Uso: python medir_inicializacao.py [--medicoes 3] [--top 15] [--registrar]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+LINHA_DE_BASE = ROOT_DIR.parent / "tests" / "linha_base_inicializacao.json"
+
+# Subsistemas opcionais que não podem entrar no caminho de inicialização
+MODULOS_SOB_DEMANDA = ["pandas", "numpy", "boto3", "relatorios", "motor", "pymongo"]
+
+
+def medir_importacao():
+    processo = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if processo.returncode != 0:
+        raise RuntimeError(processo.stderr)
+
+    # Linhas no formato: "import time:   self [us] | cumulative | imported package"
+    modulos = {}
+    for linha in processo.stderr.splitlines():
+        if not linha.startswith("import time:") or "self [us]" in linha:
+            continue
+        _, acumulado, nome = linha[len("import time:"):].split("|")
+        modulos[nome.strip()] = int(acumulado)
+    return modulos
+
+
+def razao_importacao(modulos):
+    return modulos["server"] / modulos["fastapi"]
+
+
+def melhor_medicao(medicoes: int):
+    # A primeira medição costuma pagar o cache frio do disco; vale a menor razão
+    return min((medir_importacao() for _ in range(medicoes)), key=razao_importacao)
+
+
+def carregar_linha_de_base():
+    return json.loads(LINHA_DE_BASE.read_text())
+
+
+def main(args):
+    modulos = melhor_medicao(args.medicoes)
+    total_ms = modulos["server"] / 1000
+    razao = razao_importacao(modulos)
+
+    if args.registrar:
+        base = carregar_linha_de_base() if LINHA_DE_BASE.exists() else {"tolerancia": 0.15, "medicoes": 3}
+        base["razao_server_fastapi"] = round(razao, 3)
+        LINHA_DE_BASE.write_text(json.dumps(base, indent=2) + "\n")
+        print(f"Linha de base registrada: {razao:.3f}x a importação do fastapi")
+        return 0
+
+    base = carregar_linha_de_base()
+    limite = base["razao_server_fastapi"] * (1 + base["tolerancia"])
+    print(f"Importação de server: {total_ms:.1f} ms, {razao:.2f}x a do fastapi "
+          f"(linha de base: {base['razao_server_fastapi']:.2f}x, limite: {limite:.2f}x)")
+    print("Módulos de nível superior mais caros:")
+    topo = sorted(
+        ((nome, us) for nome, us in modulos.items() if "." not in nome and nome != "server"),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    for nome, us in topo[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {nome}")
+
+    carregados = [m for m in MODULOS_SOB_DEMANDA if m in modulos]
+    ok = True
+    if carregados:
+        print(f"❌ Módulos carregados na importação que deveriam ser sob demanda: {', '.join(carregados)}")
+        ok = False
+    if razao > limite:
+        print("❌ Custo de inicialização acima da linha de base")
+        ok = False
+    if ok:
+        print("✅ Inicialização dentro da linha de base")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mede o tempo de importação do backend")
+    parser.add_argument("--medicoes", type=int, default=3, help="Importações medidas; vale a melhor")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--registrar", action="store_true", help="Grava a medição atual como nova linha de base")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,207 @@
+"""
+Cálculos pesados de relatórios (pandas)
+
+As funções deste módulo rodam no pool de processos dos jobs, por isso recebem
+e devolvem apenas dados simples (listas e dicts). A exceção é `margens_banco`,
+que lê o livro direto do MongoDB dentro do processo filho, por faixas de
+produto_id, para não trafegar o livro inteiro pelo processo da API.
+"""
+
+import os
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+
+
+def resumo_estoque(produtos: List[dict], movimentacoes: List[dict]) -> dict:
+    df_produtos = pd.DataFrame.from_records(
+        produtos,
+        columns=["id", "categoria", "quantidade_atual", "quantidade_minima", "preco_compra", "preco_venda"],
+    )
+    df_produtos["valor_custo"] = df_produtos["quantidade_atual"] * df_produtos["preco_compra"]
+    df_produtos["valor_venda"] = df_produtos["quantidade_atual"] * df_produtos["preco_venda"]
+
+    categorias = (
+        df_produtos.groupby("categoria")
+        .agg(
+            total=("id", "size"),
+            quantidade_total=("quantidade_atual", "sum"),
+            valor_custo=("valor_custo", "sum"),
+            valor_venda=("valor_venda", "sum"),
+        )
+        .reset_index()
+        .rename(columns={"categoria": "_id"})
+        .sort_values("total", ascending=False)
+    )
+
+    df_mov = pd.DataFrame.from_records(
+        movimentacoes, columns=["tipo", "motivo", "quantidade", "preco_unitario"]
+    )
+    df_mov["valor"] = df_mov["quantidade"] * df_mov["preco_unitario"]
+    por_motivo = (
+        df_mov.groupby(["tipo", "motivo"])
+        .agg(movimentacoes=("quantidade", "size"), quantidade=("quantidade", "sum"), valor=("valor", "sum"))
+        .reset_index()
+    )
+
+    return {
+        "total_produtos": int(len(df_produtos)),
+        "produtos_sem_estoque": int((df_produtos["quantidade_atual"] == 0).sum()),
+        "produtos_estoque_baixo": int(
+            ((df_produtos["quantidade_atual"] > 0)
+             & (df_produtos["quantidade_atual"] <= df_produtos["quantidade_minima"])).sum()
+        ),
+        "valor_estoque_custo": float(df_produtos["valor_custo"].sum()),
+        "valor_estoque_venda": float(df_produtos["valor_venda"].sum()),
+        "categorias": categorias.to_dict(orient="records"),
+        "movimentacoes": por_motivo.to_dict(orient="records"),
+    }
+
+
+COLUNAS_TOTAIS = ["vendas", "quantidade", "receita", "custo", "margem"]
+AGRUPAMENTOS_MARGEM = {
+    "por_periodo": ["periodo"],
+    "por_categoria": ["categoria"],
+    "por_produto": ["produto_id", "nome", "categoria"],
+}
+
+
+def _somar(df: pd.DataFrame, chaves: List[str]) -> pd.DataFrame:
+    return df.groupby(chaves)[COLUNAS_TOTAIS].sum().reset_index()
+
+
+def _percentual(totais: pd.DataFrame) -> pd.DataFrame:
+    totais["margem_percentual"] = (100 * totais["margem"] / totais["receita"].where(totais["receita"] != 0)).fillna(0)
+    return totais
+
+
+def _quadro(registros: List[dict], tipos: dict) -> pd.DataFrame:
+    # Tipos explícitos: listas vazias viram colunas object, que quebram o merge_asof
+    # e geram avisos de downcast no fillna
+    df = pd.DataFrame.from_records(registros, columns=list(tipos))
+    for coluna, tipo in tipos.items():
+        if tipo == "datetime64[ns]":
+            df[coluna] = pd.to_datetime(df[coluna]).astype(tipo)
+        else:
+            df[coluna] = df[coluna].astype(tipo)
+    return df
+
+
+def _vendas_com_preco(movimentacoes: List[dict], precos: List[dict], produtos: List[dict], periodo: str) -> pd.DataFrame:
+    df_produtos = _quadro(
+        produtos, {"id": str, "nome": str, "categoria": str, "preco_compra": "float64", "preco_venda": "float64"}
+    ).rename(columns={"id": "produto_id", "preco_compra": "preco_compra_atual", "preco_venda": "preco_venda_atual"})
+    df_mov = _quadro(
+        movimentacoes,
+        {"produto_id": str, "quantidade": "float64", "preco_unitario": "float64", "created_at": "datetime64[ns]"},
+    ).merge(df_produtos, on="produto_id", how="inner")
+    df_precos = _quadro(
+        precos,
+        {"produto_id": str, "preco_compra": "float64", "preco_venda": "float64", "vigente_desde": "datetime64[ns]"},
+    )
+
+    # Cada venda recebe o último preço vigente antes dela (as-of join por produto)
+    df = pd.merge_asof(
+        df_mov.sort_values("created_at"),
+        df_precos.sort_values("vigente_desde"),
+        left_on="created_at",
+        right_on="vigente_desde",
+        by="produto_id",
+        direction="backward",
+    )
+    # Vendas anteriores ao primeiro registro do histórico usam o preço atual do produto
+    df["preco_compra"] = df["preco_compra"].fillna(df["preco_compra_atual"])
+    df["preco_venda"] = df["preco_venda"].fillna(df["preco_venda_atual"])
+    preco_efetivo = df["preco_unitario"].where(df["preco_unitario"] > 0, df["preco_venda"])
+    df["vendas"] = 1
+    df["receita"] = df["quantidade"] * preco_efetivo
+    df["custo"] = df["quantidade"] * df["preco_compra"]
+    df["margem"] = df["receita"] - df["custo"]
+    df["periodo"] = df["created_at"].dt.to_period(periodo).dt.start_time.dt.strftime("%Y-%m-%d")
+    return df
+
+
+def _parciais(df: pd.DataFrame) -> dict:
+    return {nome: _somar(df, chaves) for nome, chaves in AGRUPAMENTOS_MARGEM.items()}
+
+
+def _relatorio(parciais: List[dict], limite_produtos: Optional[int] = None, caminho_produtos: Optional[str] = None) -> dict:
+    """Junta totais parciais (ex.: um por faixa de produto_id) no relatório final.
+
+    `por_produto` cresce com o catálogo: com `limite_produtos` só as maiores margens
+    vão no resultado, e a tabela completa pode ser gravada em `caminho_produtos`.
+    """
+    totais = {
+        nome: _percentual(_somar(pd.concat([p[nome] for p in parciais], ignore_index=True), chaves))
+        for nome, chaves in AGRUPAMENTOS_MARGEM.items()
+    }
+    por_produto = totais["por_produto"].sort_values("margem", ascending=False)
+    if caminho_produtos:
+        por_produto.to_csv(caminho_produtos, index=False)
+
+    geral = totais["por_periodo"][COLUNAS_TOTAIS].sum()
+    receita = float(geral["receita"])
+    margem = float(geral["margem"])
+    resultado = {
+        "resumo": {
+            "vendas": int(geral["vendas"]),
+            "quantidade": float(geral["quantidade"]),
+            "receita": receita,
+            "custo": float(geral["custo"]),
+            "margem": margem,
+            "margem_percentual": 100 * margem / receita if receita else 0,
+            "produtos": int(len(por_produto)),
+        },
+        "por_periodo": totais["por_periodo"].sort_values("periodo").to_dict(orient="records"),
+        "por_categoria": totais["por_categoria"].sort_values("margem", ascending=False).to_dict(orient="records"),
+        "por_produto": (por_produto if limite_produtos is None else por_produto.head(limite_produtos)).to_dict(orient="records"),
+    }
+    if caminho_produtos:
+        resultado["arquivo"] = Path(caminho_produtos).name
+    return resultado
+
+
+def margens(
+    movimentacoes: List[dict], precos: List[dict], produtos: List[dict], periodo: str = "M",
+    limite_produtos: Optional[int] = None
+) -> dict:
+    return _relatorio([_parciais(_vendas_com_preco(movimentacoes, precos, produtos, periodo))], limite_produtos)
+
+
+def margens_banco(
+    job_id: str, faixas: List[tuple], filtro_produtos: dict, filtro_mov: dict, filtro_precos: dict,
+    periodo: str, limite_produtos: int, caminho_produtos: str
+) -> dict:
+    """Calcula as margens lendo o banco faixa a faixa de produto_id.
+
+    `faixas` traz, para cada faixa, o filtro de `id` dos produtos e o de `produto_id`
+    de vendas e preços. Só os totais agregados de cada faixa ficam em memória.
+    """
+    from pymongo import MongoClient
+
+    cliente = MongoClient(os.environ["MONGO_URL"])
+    db = cliente[os.environ["DB_NAME"]]
+    try:
+        parciais = []
+        for indice, (faixa_produtos, faixa_ligados) in enumerate(faixas):
+            produtos = list(db.produtos.find(
+                {**filtro_produtos, **faixa_produtos},
+                {"_id": 0, "id": 1, "nome": 1, "categoria": 1, "preco_compra": 1, "preco_venda": 1},
+            ))
+            if produtos:
+                movimentacoes = list(db.movimentacoes.find(
+                    {**filtro_mov, **faixa_ligados},
+                    {"_id": 0, "produto_id": 1, "quantidade": 1, "preco_unitario": 1, "created_at": 1},
+                ))
+                precos = list(db.historico_precos.find(
+                    {**filtro_precos, **faixa_ligados},
+                    {"_id": 0, "produto_id": 1, "preco_compra": 1, "preco_venda": 1, "vigente_desde": 1},
+                ))
+                parciais.append(_parciais(_vendas_com_preco(movimentacoes, precos, produtos, periodo)))
+            db.jobs.update_one({"id": job_id}, {"$set": {"progresso": round((indice + 1) / len(faixas), 4)}})
+        if not parciais:
+            parciais.append(_parciais(_vendas_com_preco([], [], [], periodo)))
+        return _relatorio(parciais, limite_produtos, caminho_produtos)
+    finally:
+        cliente.close()
@@ -1,26 +1,98 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, File, HTTPException, Request, Response, UploadFile
+from fastapi.responses import FileResponse, JSONResponse
 from dotenv import load_dotenv
+from starlette.datastructures import Headers, MutableHeaders
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from contextlib import asynccontextmanager
 import os
+import math
+import random
+import asyncio
+import csv
+import gzip
+import hashlib
 import logging
+import socket
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, Dict, List, Optional, Tuple
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
 
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele a resposta sai em gzip
+    brotli = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+DIRETORIO_EXPORTACOES = Path(os.environ.get('EXPORT_DIR', ROOT_DIR / 'exportacoes'))
+DIRETORIO_IMPORTACOES = Path(os.environ.get('IMPORT_DIR', ROOT_DIR / 'importacoes'))
+JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+JOBS_PROCESSOS = int(os.environ.get('JOBS_PROCESSOS', 2))
+JOBS_CONCESSAO_SEGUNDOS = int(os.environ.get('JOBS_CONCESSAO_SEGUNDOS', 60))
+CONSOLIDACAO_FAIXAS_SEGUNDOS = float(os.environ.get('CONSOLIDACAO_FAIXAS_SEGUNDOS', 5))
+RETENCAO_RESERVAS_SEGUNDOS = int(os.environ.get('RETENCAO_RESERVAS_SEGUNDOS', 86400))
+
+# Equivalentes a pymongo.ReturnDocument: o pymongo só é carregado junto com o Motor, no lifespan
+DOCUMENTO_ANTERIOR = False
+DOCUMENTO_ATUALIZADO = True
+
+# Resíduo de ponto flutuante aceito ao comparar saldos (ex.: reservas fracionadas liberadas)
+TOLERANCIA_QUANTIDADE = 1e-6
+
+# MongoDB connection (aberta no lifespan, não na importação do módulo)
+client = None
+db = None
+
+def conectar_banco():
+    global client, db
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    return db
+
+def fechar_banco():
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
+
+async def preparar_banco():
+    # Roda em segundo plano: o processo já aceita conexões enquanto índices e tarefas sobem
+    while True:
+        try:
+            await db.command("ping")
+            await criar_indices()
+            break
+        except Exception:
+            logger.exception("Banco indisponível, tentando novamente")
+            await asyncio.sleep(2)
+    await marcar_produtos_com_depositos()
+    await iniciar_jobs()
+    await iniciar_reservas()
+    app.state.consolidacao_faixas = asyncio.create_task(tarefa_consolidacao_faixas())
+    app.state.pronto = True
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    conectar_banco()
+    app.state.pronto = False
+    preparacao = asyncio.create_task(preparar_banco())
+    yield
+    preparacao.cancel()
+    for tarefa in ("consolidacao_faixas", "expiracao_reservas"):
+        if hasattr(app.state, tarefa):
+            getattr(app.state, tarefa).cancel()
+    await encerrar_jobs()
+    fechar_banco()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -45,6 +117,7 @@ class MotivoMovimentacao(str, Enum):
     DEVOLUCAO = "devolucao"
     AJUSTE = "ajuste"
     INICIAL = "inicial"
+    TRANSFERENCIA = "transferencia"
 
 # Models
 class Produto(BaseModel):
@@ -58,6 +131,12 @@ class Produto(BaseModel):
     preco_venda: float = 0
     codigo_barras: Optional[str] = None
     ativo: bool = True
+    faixas_estoque: int = 0
+    quantidade_reservada: float = 0
+    # Ligado na primeira movimentação por depósito: daí em diante o total é a soma dos depósitos
+    usa_depositos: bool = False
+    # Contador da cadeia global de movimentações (ver MovimentacaoEstoque.seq)
+    seq_movimentacoes: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -81,6 +160,33 @@ class ProdutoUpdate(BaseModel):
     codigo_barras: Optional[str] = None
     ativo: Optional[bool] = None
 
+class OrigemPreco(str, Enum):
+    CADASTRO = "cadastro"
+    ATUALIZACAO = "atualizacao"
+    REAJUSTE = "reajuste"
+    IMPORTACAO = "importacao"
+
+class PrecoHistorico(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    produto_id: str
+    preco_compra: float
+    preco_venda: float
+    origem: OrigemPreco
+    usuario: Optional[str] = "Sistema"
+    vigente_desde: datetime = Field(default_factory=datetime.utcnow)
+
+class CampoPreco(str, Enum):
+    COMPRA = "compra"
+    VENDA = "venda"
+    AMBOS = "ambos"
+
+class ReajustePrecos(BaseModel):
+    percentual: float = Field(gt=-100)
+    campo: CampoPreco = CampoPreco.VENDA
+    categoria: Optional[str] = None
+    produto_ids: Optional[List[str]] = None
+    usuario: Optional[str] = "Sistema"
+
 class MovimentacaoEstoque(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     produto_id: str
@@ -92,22 +198,136 @@ class MovimentacaoEstoque(BaseModel):
     preco_unitario: float = 0
     observacoes: Optional[str] = None
     usuario: Optional[str] = "Sistema"
+    deposito_id: Optional[str] = None
+    transferencia_id: Optional[str] = None
+    faixa: Optional[int] = None
+    # Posição na cadeia (global, do depósito ou da faixa), incrementada na mesma escrita do saldo:
+    # ordena a auditoria mesmo quando created_at de escritas concorrentes sai fora de ordem
+    seq: Optional[int] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class MovimentacaoCreate(BaseModel):
     produto_id: str
     tipo: TipoMovimentacao
     motivo: MotivoMovimentacao
-    quantidade: float
+    quantidade: float = Field(gt=0)
     preco_unitario: float = 0
     observacoes: Optional[str] = None
     usuario: Optional[str] = "Sistema"
+    deposito_id: Optional[str] = None
+
+class Deposito(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    nome: str
+    codigo: Optional[str] = None
+    ativo: bool = True
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class DepositoCreate(BaseModel):
+    nome: str
+    codigo: Optional[str] = None
+
+class EstoqueDeposito(BaseModel):
+    deposito_id: str
+    produto_id: str
+    quantidade: float = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class StatusReserva(str, Enum):
+    ATIVA = "ativa"
+    CONFIRMADA = "confirmada"
+    LIBERADA = "liberada"
+    EXPIRADA = "expirada"
+
+class Reserva(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    produto_id: str
+    quantidade: float
+    status: StatusReserva = StatusReserva.ATIVA
+    referencia: Optional[str] = None
+    usuario: Optional[str] = "Sistema"
+    deposito_id: Optional[str] = None
+    movimentacao_id: Optional[str] = None
+    expira_em: datetime
+    # Só é preenchido quando a reserva é finalizada: o índice TTL nunca apaga reservas ativas
+    remover_em: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    finalizada_em: Optional[datetime] = None
+
+class ReservaCreate(BaseModel):
+    produto_id: str
+    quantidade: float = Field(gt=0)
+    ttl_segundos: int = Field(900, ge=1, le=7 * 86400)
+    referencia: Optional[str] = None
+    usuario: Optional[str] = "Sistema"
+    deposito_id: Optional[str] = None
+
+class ReservaConfirmacao(BaseModel):
+    preco_unitario: Optional[float] = None
+    observacoes: Optional[str] = None
+
+class Disponibilidade(BaseModel):
+    produto_id: str
+    quantidade_atual: float
+    quantidade_reservada: float
+    disponivel: float
+
+class ContadorDistribuidoConfig(BaseModel):
+    faixas: int = Field(8, ge=2, le=64)
+
+class TransferenciaCreate(BaseModel):
+    produto_id: str
+    deposito_origem_id: str
+    deposito_destino_id: str
+    quantidade: float = Field(gt=0)
+    observacoes: Optional[str] = None
+    usuario: Optional[str] = "Sistema"
+
+# Versão do catálogo e cache condicional (ETag)
+async def obter_versao_catalogo() -> str:
+    controle = await db.controle.find_one({"_id": "catalogo"})
+    if not controle:
+        return "0-0"
+    return f"{controle['geracao']}-{controle['versao']}"
+
+async def incrementar_versao_catalogo():
+    await db.controle.update_one(
+        {"_id": "catalogo"},
+        {"$inc": {"versao": 1}, "$setOnInsert": {"geracao": uuid.uuid4().hex[:8]}},
+        upsert=True
+    )
+
+async def etag_catalogo(request: Request) -> str:
+    versao = await obter_versao_catalogo()
+    parametros = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    assinatura = hashlib.sha1(f"{request.url.path}?{parametros}".encode()).hexdigest()[:12]
+    return f'"{versao}-{assinatura}"'
+
+def etag_corresponde(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidato in if_none_match.split(","):
+        candidato = candidato.strip()
+        # O middleware de compressão acrescenta a codificação à ETag
+        for sufixo in ("-gzip\"", "-br\""):
+            if candidato.endswith(sufixo):
+                candidato = candidato[: -len(sufixo)] + '"'
+        if candidato == etag:
+            return True
+    return False
+
+def cabecalhos_cache(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": "no-cache"}
 
 # CRUD Produtos
+LOTE_REAJUSTE = 1000
+
 @api_router.post("/produtos", response_model=Produto)
 async def criar_produto(produto: ProdutoCreate):
     produto_dict = produto.dict()
-    produto_obj = Produto(**produto_dict)
+    produto_obj = Produto(**produto_dict, seq_movimentacoes=1 if produto.quantidade_atual > 0 else 0)
     
     # Verificar se já existe produto com mesmo nome
     existing = await db.produtos.find_one({"nome": produto_obj.nome, "ativo": True})
@@ -115,6 +335,13 @@ async def criar_produto(produto: ProdutoCreate):
         raise HTTPException(status_code=400, detail="Produto com este nome já existe")
     
     await db.produtos.insert_one(produto_obj.dict())
+    await db.historico_precos.insert_one(PrecoHistorico(
+        produto_id=produto_obj.id,
+        preco_compra=produto_obj.preco_compra,
+        preco_venda=produto_obj.preco_venda,
+        origem=OrigemPreco.CADASTRO,
+        vigente_desde=produto_obj.created_at
+    ).dict())
     
     # Criar movimentação inicial se quantidade > 0
     if produto_obj.quantidade_atual > 0:
@@ -125,18 +352,27 @@ async def criar_produto(produto: ProdutoCreate):
             quantidade=produto_obj.quantidade_atual,
             quantidade_anterior=0,
             quantidade_nova=produto_obj.quantidade_atual,
-            preco_unitario=produto_obj.preco_compra
+            preco_unitario=produto_obj.preco_compra,
+            seq=1
         )
         await db.movimentacoes.insert_one(movimentacao.dict())
     
+    await incrementar_versao_catalogo()
     return produto_obj
 
 @api_router.get("/produtos", response_model=List[Produto])
 async def listar_produtos(
+    request: Request,
+    response: Response,
     categoria: Optional[str] = None,
     busca: Optional[str] = None,
     apenas_ativos: bool = True
 ):
+    etag = await etag_catalogo(request)
+    if etag_corresponde(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cabecalhos_cache(etag))
+    response.headers.update(cabecalhos_cache(etag))
+    
     filter_dict = {}
     if apenas_ativos:
         filter_dict["ativo"] = True
@@ -154,13 +390,85 @@ async def listar_produtos(
                busca_lower in p.get("codigo_barras", "").lower()
         ]
     
+    produtos = await aplicar_saldo_faixas(produtos)
     return [Produto(**produto) for produto in produtos]
 
+@api_router.post("/produtos/reajuste")
+async def reajustar_precos(reajuste: ReajustePrecos):
+    from pymongo import UpdateOne
+
+    if not reajuste.categoria and not reajuste.produto_ids:
+        raise HTTPException(status_code=400, detail="Informe a categoria ou a lista de produtos")
+    
+    filter_dict = {"ativo": True}
+    if reajuste.categoria:
+        filter_dict["categoria"] = reajuste.categoria
+    if reajuste.produto_ids:
+        filter_dict["id"] = {"$in": reajuste.produto_ids}
+    
+    fator = 1 + reajuste.percentual / 100
+    campos = {
+        CampoPreco.COMPRA: ["preco_compra"],
+        CampoPreco.VENDA: ["preco_venda"],
+        CampoPreco.AMBOS: ["preco_compra", "preco_venda"],
+    }[reajuste.campo]
+    agora = datetime.utcnow()
+    atualizados = 0
+    
+    async def aplicar(lote):
+        await db.produtos.bulk_write([
+            UpdateOne({"id": p["id"]}, {"$set": {**{c: p[c] for c in campos}, "updated_at": agora}})
+            for p in lote
+        ], ordered=False)
+        await db.historico_precos.insert_many([
+            PrecoHistorico(
+                produto_id=p["id"],
+                preco_compra=p["preco_compra"],
+                preco_venda=p["preco_venda"],
+                origem=OrigemPreco.REAJUSTE,
+                usuario=reajuste.usuario,
+                vigente_desde=agora
+            ).dict()
+            for p in lote
+        ], ordered=False)
+    
+    lote = []
+    async for produto in db.produtos.find(
+        filter_dict, {"_id": 0, "id": 1, "preco_compra": 1, "preco_venda": 1}
+    ).batch_size(LOTE_REAJUSTE):
+        produto.setdefault("preco_compra", 0)
+        produto.setdefault("preco_venda", 0)
+        for campo in campos:
+            produto[campo] = round(produto[campo] * fator, 2)
+        lote.append(produto)
+        if len(lote) >= LOTE_REAJUSTE:
+            await aplicar(lote)
+            atualizados += len(lote)
+            lote = []
+    if lote:
+        await aplicar(lote)
+        atualizados += len(lote)
+    
+    if atualizados:
+        await incrementar_versao_catalogo()
+    return {"produtos_atualizados": atualizados, "vigente_desde": agora}
+
+@api_router.get("/produtos/{produto_id}/historico-precos", response_model=List[PrecoHistorico])
+async def listar_historico_precos(produto_id: str, limit: int = 100):
+    historico = await db.historico_precos.find(
+        {"produto_id": produto_id}
+    ).sort("vigente_desde", -1).limit(limit).to_list(limit)
+    return [PrecoHistorico(**h) for h in historico]
+
 @api_router.get("/produtos/{produto_id}", response_model=Produto)
 async def obter_produto(produto_id: str):
     produto = await db.produtos.find_one({"id": produto_id})
     if not produto:
         raise HTTPException(status_code=404, detail="Produto não encontrado")
+    if produto.get("faixas_estoque"):
+        quantidade = await consolidar_faixas(produto_id)
+        if quantidade is not None:
+            produto["quantidade_atual"] = quantidade
     return Produto(**produto)
 
 @api_router.put("/produtos/{produto_id}", response_model=Produto)
@@ -174,6 +482,19 @@ async def atualizar_produto(produto_id: str, produto_update: ProdutoUpdate):
     
     await db.produtos.update_one({"id": produto_id}, {"$set": update_dict})
     
+    # Registrar novo preço vigente no histórico
+    preco_compra = update_dict.get("preco_compra", produto.get("preco_compra", 0))
+    preco_venda = update_dict.get("preco_venda", produto.get("preco_venda", 0))
+    if preco_compra != produto.get("preco_compra", 0) or preco_venda != produto.get("preco_venda", 0):
+        await db.historico_precos.insert_one(PrecoHistorico(
+            produto_id=produto_id,
+            preco_compra=preco_compra,
+            preco_venda=preco_venda,
+            origem=OrigemPreco.ATUALIZACAO,
+            vigente_desde=update_dict["updated_at"]
+        ).dict())
+    await incrementar_versao_catalogo()
+    
     produto_atualizado = await db.produtos.find_one({"id": produto_id})
     return Produto(**produto_atualizado)
 
@@ -184,63 +505,906 @@ async def deletar_produto(produto_id: str):
         raise HTTPException(status_code=404, detail="Produto não encontrado")
     
     await db.produtos.update_one({"id": produto_id}, {"$set": {"ativo": False}})
+    await incrementar_versao_catalogo()
     return {"message": "Produto desativado com sucesso"}
 
 # Movimentações de Estoque
+ERRO_INFORME_DEPOSITO = "Produto controlado por depósitos: informe deposito_id"
+
+async def alterar_saldo_produto(produto_id: str, delta: float, por_deposito: bool = False) -> dict:
+    """Aplica `delta` em quantidade_atual com um único $inc e devolve o produto atualizado.
+
+    Saídas só são aplicadas se quantidade_atual - quantidade_reservada cobrir a quantidade,
+    então escritas concorrentes nunca se sobrescrevem nem consomem estoque reservado.
+
+    Produtos controlados por depósitos só aceitam alterações `por_deposito`, e um produto
+    só passa a usar depósitos com o saldo global zerado: assim o total é sempre a soma
+    dos depósitos.
+    """
+    filtro = {"id": produto_id, "ativo": True, "faixas_estoque": {"$in": [0, None]}}
+    atualizacao = {"$inc": {"quantidade_atual": delta, "seq_movimentacoes": 1}, "$set": {"updated_at": datetime.utcnow()}}
+    if por_deposito:
+        filtro["$or"] = [
+            {"usa_depositos": True},
+            {"quantidade_atual": {"$gt": -TOLERANCIA_QUANTIDADE, "$lt": TOLERANCIA_QUANTIDADE}}
+        ]
+        atualizacao["$set"]["usa_depositos"] = True
+    else:
+        filtro["usa_depositos"] = {"$ne": True}
+    if delta < 0:
+        filtro["$expr"] = {"$gte": [
+            {"$subtract": ["$quantidade_atual", {"$ifNull": ["$quantidade_reservada", 0]}]},
+            -delta
+        ]}
+    produto = await db.produtos.find_one_and_update(filtro, atualizacao, return_document=DOCUMENTO_ATUALIZADO)
+    if not produto:
+        atual = await db.produtos.find_one({"id": produto_id, "ativo": True})
+        if not atual:
+            raise HTTPException(status_code=404, detail="Produto não encontrado")
+        if atual.get("faixas_estoque"):
+            raise HTTPException(status_code=409, detail="Produto passou a usar contador distribuído, repita a operação")
+        if atual.get("usa_depositos") and not por_deposito:
+            raise HTTPException(status_code=400, detail=ERRO_INFORME_DEPOSITO)
+        if por_deposito and not atual.get("usa_depositos") and abs(atual["quantidade_atual"]) >= TOLERANCIA_QUANTIDADE:
+            raise HTTPException(
+                status_code=400,
+                detail="Produto com saldo fora de depósitos: zere o saldo global antes de movimentar por depósito"
+            )
+        disponivel = atual["quantidade_atual"] - atual.get("quantidade_reservada", 0)
+        raise HTTPException(status_code=400, detail=f"Estoque insuficiente. Disponível: {disponivel}")
+    return produto
+
 @api_router.post("/movimentacoes", response_model=MovimentacaoEstoque)
 async def criar_movimentacao(movimentacao: MovimentacaoCreate):
     produto = await db.produtos.find_one({"id": movimentacao.produto_id, "ativo": True})
     if not produto:
         raise HTTPException(status_code=404, detail="Produto não encontrado")
     
-    quantidade_anterior = produto["quantidade_atual"]
+    if movimentacao.deposito_id:
+        if produto.get("faixas_estoque"):
+            raise HTTPException(status_code=400, detail="Produto com contador distribuído não aceita movimentação por depósito")
+        return await criar_movimentacao_deposito(movimentacao)
+    if produto.get("faixas_estoque"):
+        return await criar_movimentacao_distribuida(movimentacao, produto["faixas_estoque"])
     
-    if movimentacao.tipo == TipoMovimentacao.ENTRADA:
-        quantidade_nova = quantidade_anterior + movimentacao.quantidade
-    else:  # SAIDA
-        quantidade_nova = quantidade_anterior - movimentacao.quantidade
-        if quantidade_nova < 0:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Estoque insuficiente. Disponível: {quantidade_anterior}"
-            )
+    delta = movimentacao.quantidade if movimentacao.tipo == TipoMovimentacao.ENTRADA else -movimentacao.quantidade
+    produto = await alterar_saldo_produto(movimentacao.produto_id, delta)
     
-    # Criar movimentação
+    # Criar movimentação com o saldo antes e depois da própria escrita
+    quantidade_nova = produto["quantidade_atual"]
     movimentacao_obj = MovimentacaoEstoque(
         **movimentacao.dict(),
-        quantidade_anterior=quantidade_anterior,
-        quantidade_nova=quantidade_nova
-    )
-    
-    await db.movimentacoes.insert_one(movimentacao_obj.dict())
-    
-    # Atualizar quantidade do produto
-    await db.produtos.update_one(
-        {"id": movimentacao.produto_id},
-        {"$set": {"quantidade_atual": quantidade_nova, "updated_at": datetime.utcnow()}}
+        quantidade_anterior=quantidade_nova - delta,
+        quantidade_nova=quantidade_nova,
+        seq=produto["seq_movimentacoes"]
     )
+    try:
+        await db.movimentacoes.insert_one(movimentacao_obj.dict())
+    except Exception:
+        await db.produtos.update_one({"id": movimentacao.produto_id}, {"$inc": {"quantidade_atual": -delta}})
+        raise
+    await incrementar_versao_catalogo()
     
     return movimentacao_obj
 
 @api_router.get("/movimentacoes", response_model=List[MovimentacaoEstoque])
-async def listar_movimentacoes(produto_id: Optional[str] = None, limit: int = 100):
+async def listar_movimentacoes(
+    produto_id: Optional[str] = None,
+    deposito_id: Optional[str] = None,
+    limit: int = 100
+):
     filter_dict = {}
     if produto_id:
         filter_dict["produto_id"] = produto_id
+    if deposito_id:
+        filter_dict["deposito_id"] = deposito_id
     
     movimentacoes = await db.movimentacoes.find(filter_dict).sort("created_at", -1).limit(limit).to_list(limit)
     return [MovimentacaoEstoque(**mov) for mov in movimentacoes]
 
+# Depósitos e estoque por local
+async def obter_deposito_ativo(deposito_id: str) -> dict:
+    deposito = await db.depositos.find_one({"id": deposito_id, "ativo": True})
+    if not deposito:
+        raise HTTPException(status_code=404, detail="Depósito não encontrado")
+    return deposito
+
+async def alterar_estoque_deposito(deposito_id: str, produto_id: str, delta: float) -> Tuple[float, int]:
+    """Aplica `delta` ao saldo do depósito de forma atômica e devolve (novo saldo, seq).
+
+    Saídas só são aplicadas se o saldo do próprio depósito, descontadas as reservas
+    feitas nele, cobrir a quantidade.
+    """
+    if delta < 0:
+        estoque = await db.estoques.find_one_and_update(
+            {
+                "deposito_id": deposito_id,
+                "produto_id": produto_id,
+                "$expr": {"$gte": [
+                    {"$subtract": ["$quantidade", {"$ifNull": ["$quantidade_reservada", 0]}]},
+                    -delta
+                ]}
+            },
+            {"$inc": {"quantidade": delta, "seq": 1}, "$set": {"updated_at": datetime.utcnow()}},
+            return_document=DOCUMENTO_ATUALIZADO
+        )
+        if not estoque:
+            atual = await db.estoques.find_one({"deposito_id": deposito_id, "produto_id": produto_id})
+            disponivel = atual["quantidade"] - atual.get("quantidade_reservada", 0) if atual else 0
+            raise HTTPException(
+                status_code=400,
+                detail=f"Estoque insuficiente no depósito. Disponível: {disponivel}"
+            )
+    else:
+        estoque = await db.estoques.find_one_and_update(
+            {"deposito_id": deposito_id, "produto_id": produto_id},
+            {"$inc": {"quantidade": delta, "seq": 1}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True,
+            return_document=DOCUMENTO_ATUALIZADO
+        )
+    return estoque["quantidade"], estoque["seq"]
+
+async def marcar_produtos_com_depositos():
+    # Produtos com saldo em depósitos gravados antes de existir usa_depositos
+    lote = []
+    async for estoque in db.estoques.find({"quantidade": {"$ne": 0}}, {"_id": 0, "produto_id": 1}):
+        lote.append(estoque["produto_id"])
+        if len(lote) >= LOTE_REAJUSTE:
+            await db.produtos.update_many({"id": {"$in": lote}}, {"$set": {"usa_depositos": True}})
+            lote = []
+    if lote:
+        await db.produtos.update_many({"id": {"$in": lote}}, {"$set": {"usa_depositos": True}})
+
+async def criar_movimentacao_deposito(movimentacao: MovimentacaoCreate) -> MovimentacaoEstoque:
+    await obter_deposito_ativo(movimentacao.deposito_id)
+    delta = movimentacao.quantidade if movimentacao.tipo == TipoMovimentacao.ENTRADA else -movimentacao.quantidade
+    
+    # O total do produto é a soma dos depósitos e é alterado primeiro, com a mesma
+    # guarda das saídas globais: vender por depósito também não consome estoque reservado.
+    await alterar_saldo_produto(movimentacao.produto_id, delta, por_deposito=True)
+    try:
+        quantidade_nova, seq = await alterar_estoque_deposito(movimentacao.deposito_id, movimentacao.produto_id, delta)
+    except Exception:
+        await db.produtos.update_one({"id": movimentacao.produto_id}, {"$inc": {"quantidade_atual": -delta}})
+        raise
+    
+    movimentacao_obj = MovimentacaoEstoque(
+        **movimentacao.dict(),
+        quantidade_anterior=quantidade_nova - delta,
+        quantidade_nova=quantidade_nova,
+        seq=seq
+    )
+    try:
+        await db.movimentacoes.insert_one(movimentacao_obj.dict())
+    except Exception:
+        await alterar_estoque_deposito(movimentacao.deposito_id, movimentacao.produto_id, -delta)
+        await db.produtos.update_one({"id": movimentacao.produto_id}, {"$inc": {"quantidade_atual": -delta}})
+        raise
+    await incrementar_versao_catalogo()
+    
+    return movimentacao_obj
+
+@api_router.post("/depositos", response_model=Deposito)
+async def criar_deposito(deposito: DepositoCreate):
+    existing = await db.depositos.find_one({"nome": deposito.nome, "ativo": True})
+    if existing:
+        raise HTTPException(status_code=400, detail="Depósito com este nome já existe")
+    
+    deposito_obj = Deposito(**deposito.dict())
+    await db.depositos.insert_one(deposito_obj.dict())
+    return deposito_obj
+
+@api_router.get("/depositos", response_model=List[Deposito])
+async def listar_depositos(apenas_ativos: bool = True):
+    filter_dict = {"ativo": True} if apenas_ativos else {}
+    depositos = await db.depositos.find(filter_dict).sort("nome", 1).to_list(1000)
+    return [Deposito(**d) for d in depositos]
+
+@api_router.get("/depositos/{deposito_id}/estoque", response_model=List[EstoqueDeposito])
+async def listar_estoque_deposito(deposito_id: str, apenas_baixo: bool = False, limit: int = 1000):
+    await obter_deposito_ativo(deposito_id)
+    if apenas_baixo:
+        itens = await db.estoques.aggregate(
+            pipeline_estoque_baixo_deposito(deposito_id) + [{"$limit": limit}]
+        ).to_list(limit)
+    else:
+        itens = await db.estoques.find({"deposito_id": deposito_id}).limit(limit).to_list(limit)
+    return [EstoqueDeposito(**item) for item in itens]
+
+@api_router.post("/transferencias", response_model=List[MovimentacaoEstoque])
+async def criar_transferencia(transferencia: TransferenciaCreate):
+    if transferencia.deposito_origem_id == transferencia.deposito_destino_id:
+        raise HTTPException(status_code=400, detail="Depósitos de origem e destino devem ser diferentes")
+    produto = await db.produtos.find_one({"id": transferencia.produto_id, "ativo": True})
+    if not produto:
+        raise HTTPException(status_code=404, detail="Produto não encontrado")
+    await obter_deposito_ativo(transferencia.deposito_origem_id)
+    await obter_deposito_ativo(transferencia.deposito_destino_id)
+    
+    # A saída da origem é condicional e atômica; se a entrada no destino falhar,
+    # a origem é recomposta para que o par nunca fique pela metade.
+    quantidade = transferencia.quantidade
+    origem_nova, origem_seq = await alterar_estoque_deposito(
+        transferencia.deposito_origem_id, transferencia.produto_id, -quantidade
+    )
+    try:
+        destino_nova, destino_seq = await alterar_estoque_deposito(
+            transferencia.deposito_destino_id, transferencia.produto_id, quantidade
+        )
+    except Exception:
+        await alterar_estoque_deposito(transferencia.deposito_origem_id, transferencia.produto_id, quantidade)
+        raise
+    
+    transferencia_id = str(uuid.uuid4())
+    comum = {
+        "produto_id": transferencia.produto_id,
+        "motivo": MotivoMovimentacao.TRANSFERENCIA,
+        "quantidade": quantidade,
+        "preco_unitario": produto.get("preco_compra", 0),
+        "observacoes": transferencia.observacoes,
+        "usuario": transferencia.usuario,
+        "transferencia_id": transferencia_id,
+    }
+    movimentacoes = [
+        MovimentacaoEstoque(
+            **comum,
+            tipo=TipoMovimentacao.SAIDA,
+            deposito_id=transferencia.deposito_origem_id,
+            quantidade_anterior=origem_nova + quantidade,
+            quantidade_nova=origem_nova,
+            seq=origem_seq
+        ),
+        MovimentacaoEstoque(
+            **comum,
+            tipo=TipoMovimentacao.ENTRADA,
+            deposito_id=transferencia.deposito_destino_id,
+            quantidade_anterior=destino_nova - quantidade,
+            quantidade_nova=destino_nova,
+            seq=destino_seq
+        ),
+    ]
+    try:
+        await db.movimentacoes.insert_many([m.dict() for m in movimentacoes])
+    except Exception:
+        # Sem o par no livro o saldo movido não teria registro: desfaz a transferência
+        await db.movimentacoes.delete_many({"transferencia_id": transferencia_id})
+        await alterar_estoque_deposito(transferencia.deposito_destino_id, transferencia.produto_id, -quantidade)
+        await alterar_estoque_deposito(transferencia.deposito_origem_id, transferencia.produto_id, quantidade)
+        raise
+    await incrementar_versao_catalogo()
+    return movimentacoes
+
+# Contadores distribuídos (produtos de alta rotatividade)
+PRAZO_BLOQUEIO_FAIXAS_SEGUNDOS = 30
+
+async def somar_faixas(produto_ids: List[str]) -> Dict[str, float]:
+    # Faixas fechadas pertencem a uma desativação e já foram (ou estão sendo) consolidadas
+    pipeline = [
+        {"$match": {"produto_id": {"$in": produto_ids}, "fechada": {"$ne": True}}},
+        {"$group": {"_id": "$produto_id", "quantidade": {"$sum": "$quantidade"}}}
+    ]
+    return {r["_id"]: r["quantidade"] for r in await db.estoque_faixas.aggregate(pipeline).to_list(None)}
+
+async def aplicar_saldo_faixas(produtos: List[dict]) -> List[dict]:
+    ids = [p["id"] for p in produtos if p.get("faixas_estoque")]
+    if ids:
+        saldos = await somar_faixas(ids)
+        for produto in produtos:
+            if produto["id"] in saldos:
+                produto["quantidade_atual"] = saldos[produto["id"]]
+    return produtos
+
+async def consolidar_faixas(produto_id: str) -> Optional[float]:
+    saldos = await somar_faixas([produto_id])
+    if produto_id not in saldos:
+        return None
+    # Se o contador foi desativado no meio tempo, o saldo gravado pela desativação prevalece
+    await db.produtos.update_one(
+        {"id": produto_id, "faixas_estoque": {"$gt": 0}},
+        {"$set": {"quantidade_atual": saldos[produto_id]}}
+    )
+    return saldos[produto_id]
+
+async def consolidar_todas_faixas():
+    from pymongo import UpdateOne
+
+    ids = await db.produtos.distinct("id", {"faixas_estoque": {"$gt": 0}})
+    if not ids:
+        return
+    saldos = await somar_faixas(ids)
+    if not saldos:
+        return
+    resultado = await db.produtos.bulk_write([
+        UpdateOne(
+            {"id": produto_id, "faixas_estoque": {"$gt": 0}, "quantidade_atual": {"$ne": quantidade}},
+            {"$set": {"quantidade_atual": quantidade, "updated_at": datetime.utcnow()}}
+        )
+        for produto_id, quantidade in saldos.items()
+    ], ordered=False)
+    if resultado.modified_count:
+        await incrementar_versao_catalogo()
+
+async def tarefa_consolidacao_faixas():
+    while True:
+        await asyncio.sleep(CONSOLIDACAO_FAIXAS_SEGUNDOS)
+        try:
+            await consolidar_todas_faixas()
+        except Exception:
+            logger.exception("Erro ao consolidar contadores distribuídos")
+
+async def bloquear_faixas(produto_id: str) -> bool:
+    """Reserva as faixas do produto para uma concentração ou desativação.
+
+    O bloqueio expira sozinho para não prender o produto se o processo cair no meio.
+    """
+    agora = datetime.utcnow()
+    produto = await db.produtos.find_one_and_update(
+        {
+            "id": produto_id,
+            "faixas_estoque": {"$gt": 0},
+            "$or": [{"faixas_bloqueadas_ate": None}, {"faixas_bloqueadas_ate": {"$lte": agora}}]
+        },
+        {"$set": {"faixas_bloqueadas_ate": agora + timedelta(seconds=PRAZO_BLOQUEIO_FAIXAS_SEGUNDOS)}}
+    )
+    return produto is not None
+
+async def desbloquear_faixas(produto_id: str):
+    await db.produtos.update_one({"id": produto_id}, {"$set": {"faixas_bloqueadas_ate": None}})
+
+def _erro_faixas_indisponiveis() -> HTTPException:
+    return HTTPException(status_code=409, detail="Contador distribuído em reconfiguração, repita a operação")
+
+async def _concentrar_faixas(produto_id: str, faixas: int, destino: int) -> bool:
+    # Zera as outras faixas de forma atômica e transfere o que havia nelas para o destino.
+    # Durante a troca o saldo some temporariamente, o que só deixa as saídas mais conservadoras.
+    # Cada troca vira um par de movimentações para que a cadeia de cada faixa continue fechando.
+    # Devolve False se outra concentração ou desativação está com as faixas.
+    if not await bloquear_faixas(produto_id):
+        return False
+    try:
+        movimentacoes = []
+        for faixa in range(faixas):
+            if faixa == destino:
+                continue
+            origem_doc = await db.estoque_faixas.find_one_and_update(
+                {"produto_id": produto_id, "faixa": faixa, "quantidade": {"$gt": 0}, "fechada": {"$ne": True}},
+                {"$set": {"quantidade": 0}, "$inc": {"seq": 1}},
+                return_document=DOCUMENTO_ANTERIOR
+            )
+            if not origem_doc:
+                continue
+            movido = origem_doc["quantidade"]
+            destino_doc = await db.estoque_faixas.find_one_and_update(
+                {"produto_id": produto_id, "faixa": destino},
+                {"$inc": {"quantidade": movido, "seq": 1}},
+                return_document=DOCUMENTO_ATUALIZADO
+            )
+            comum = {
+                "produto_id": produto_id,
+                "motivo": MotivoMovimentacao.TRANSFERENCIA,
+                "quantidade": movido,
+                "observacoes": "Concentração de faixas",
+                "transferencia_id": str(uuid.uuid4()),
+            }
+            movimentacoes += [
+                MovimentacaoEstoque(
+                    **comum, tipo=TipoMovimentacao.SAIDA, faixa=faixa,
+                    quantidade_anterior=movido, quantidade_nova=0, seq=origem_doc.get("seq", 0) + 1
+                ),
+                MovimentacaoEstoque(
+                    **comum, tipo=TipoMovimentacao.ENTRADA, faixa=destino,
+                    quantidade_anterior=destino_doc["quantidade"] - movido,
+                    quantidade_nova=destino_doc["quantidade"], seq=destino_doc["seq"]
+                ),
+            ]
+        if movimentacoes:
+            await db.movimentacoes.insert_many([m.dict() for m in movimentacoes])
+    finally:
+        await desbloquear_faixas(produto_id)
+    return True
+
+async def alterar_faixa_estoque(produto_id: str, faixas: int, delta: float) -> Tuple[int, float, int]:
+    """Aplica `delta` em uma das faixas do produto e devolve (faixa, novo saldo da faixa, seq).
+
+    Cada saída só consome a folga da própria faixa, então o total nunca fica negativo.
+    Faixas fechadas por uma desativação recusam escritas em vez de perdê-las.
+    """
+    inicio = random.randrange(faixas)
+    concentrou = False
+    if delta >= 0:
+        faixa_doc = await db.estoque_faixas.find_one_and_update(
+            {"produto_id": produto_id, "faixa": inicio, "fechada": {"$ne": True}},
+            {"$inc": {"quantidade": delta, "seq": 1}},
+            return_document=DOCUMENTO_ATUALIZADO
+        )
+        if not faixa_doc:
+            raise _erro_faixas_indisponiveis()
+        return inicio, faixa_doc["quantidade"], faixa_doc["seq"]
+    
+    for tentativa in range(faixas + 1):
+        if tentativa == faixas:
+            # Nenhuma faixa tem folga sozinha: concentra o saldo e tenta uma última vez
+            concentrou = await _concentrar_faixas(produto_id, faixas, inicio)
+        faixa = (inicio + tentativa) % faixas
+        faixa_doc = await db.estoque_faixas.find_one_and_update(
+            {"produto_id": produto_id, "faixa": faixa, "quantidade": {"$gte": -delta}, "fechada": {"$ne": True}},
+            {"$inc": {"quantidade": delta, "seq": 1}},
+            return_document=DOCUMENTO_ATUALIZADO
+        )
+        if faixa_doc:
+            return faixa, faixa_doc["quantidade"], faixa_doc["seq"]
+    
+    # Só é falta de estoque se a concentração aconteceu e o total não cobre a saída;
+    # sem o bloqueio, ou com saldo que chegou depois, o cliente deve repetir
+    saldos = await somar_faixas([produto_id])
+    if produto_id not in saldos or not concentrou or saldos[produto_id] >= -delta:
+        raise _erro_faixas_indisponiveis()
+    raise HTTPException(status_code=400, detail=f"Estoque insuficiente. Disponível: {saldos[produto_id]}")
+
+async def criar_movimentacao_distribuida(movimentacao: MovimentacaoCreate, faixas: int) -> MovimentacaoEstoque:
+    delta = movimentacao.quantidade if movimentacao.tipo == TipoMovimentacao.ENTRADA else -movimentacao.quantidade
+    faixa, quantidade_nova, seq = await alterar_faixa_estoque(movimentacao.produto_id, faixas, delta)
+    
+    # quantidade_anterior/nova se referem à faixa; o total do produto é consolidado periodicamente
+    movimentacao_obj = MovimentacaoEstoque(
+        **movimentacao.dict(),
+        faixa=faixa,
+        quantidade_anterior=quantidade_nova - delta,
+        quantidade_nova=quantidade_nova,
+        seq=seq
+    )
+    await db.movimentacoes.insert_one(movimentacao_obj.dict())
+    return movimentacao_obj
+
+@api_router.post("/produtos/{produto_id}/contador-distribuido", response_model=Produto)
+async def ativar_contador_distribuido(produto_id: str, config: ContadorDistribuidoConfig):
+    # Faixas não conhecem quantidade_reservada: só ativa sem reservas abertas, e
+    # criar_reserva recusa produtos com faixas, então os dois modos nunca convivem.
+    produto = await db.produtos.find_one_and_update(
+        {
+            "id": produto_id,
+            "ativo": True,
+            "faixas_estoque": {"$in": [0, None]},
+            # Saldo por depósito e por faixa são modos exclusivos: o total não pode ter duas fontes
+            "usa_depositos": {"$ne": True},
+            # Tolerância: reservas fracionadas liberadas podem deixar um resíduo de ponto flutuante
+            "$or": [
+                {"quantidade_reservada": None},
+                {"quantidade_reservada": {"$gt": -TOLERANCIA_QUANTIDADE, "$lt": TOLERANCIA_QUANTIDADE}}
+            ]
+        },
+        {"$set": {
+            "faixas_estoque": config.faixas,
+            "quantidade_reservada": 0,
+            # Segura concentração e desativação até as faixas novas existirem
+            "faixas_bloqueadas_ate": datetime.utcnow() + timedelta(seconds=PRAZO_BLOQUEIO_FAIXAS_SEGUNDOS),
+            "updated_at": datetime.utcnow()
+        }, "$inc": {"seq_movimentacoes": 1}},
+        return_document=DOCUMENTO_ATUALIZADO
+    )
+    if not produto:
+        atual = await db.produtos.find_one({"id": produto_id, "ativo": True})
+        if not atual:
+            raise HTTPException(status_code=404, detail="Produto não encontrado")
+        if atual.get("faixas_estoque"):
+            raise HTTPException(status_code=400, detail="Produto já usa contador distribuído")
+        if atual.get("usa_depositos"):
+            raise HTTPException(status_code=400, detail="Produto controlado por depósitos não aceita contador distribuído")
+        raise HTTPException(status_code=400, detail="Produto possui reservas ativas")
+    
+    # Reparte o saldo atual entre as faixas, reabrindo as faixas fechadas de uma desativação anterior.
+    # Enquanto uma faixa não é reaberta, as escritas nela recebem 409 em vez de se perderem.
+    # A repartição é registrada como transferência do saldo global para as faixas, então a
+    # cadeia global e a de cada faixa continuam fechando na auditoria.
+    quantidade = produto["quantidade_atual"]
+    parte = quantidade / config.faixas
+    partes = [parte] * (config.faixas - 1) + [quantidade - parte * (config.faixas - 1)]
+    comum = {
+        "produto_id": produto_id,
+        "motivo": MotivoMovimentacao.TRANSFERENCIA,
+        "observacoes": "Ativação do contador distribuído",
+        "transferencia_id": str(uuid.uuid4()),
+    }
+    movimentacoes = [
+        MovimentacaoEstoque(
+            **comum, tipo=TipoMovimentacao.SAIDA, quantidade=quantidade,
+            quantidade_anterior=quantidade, quantidade_nova=0, seq=produto["seq_movimentacoes"]
+        )
+    ]
+    for faixa, valor in enumerate(partes):
+        faixa_doc = await db.estoque_faixas.find_one_and_update(
+            {"produto_id": produto_id, "faixa": faixa},
+            {"$set": {"quantidade": valor, "fechada": False}, "$inc": {"seq": 1}},
+            upsert=True,
+            return_document=DOCUMENTO_ATUALIZADO
+        )
+        movimentacoes.append(MovimentacaoEstoque(
+            **comum, tipo=TipoMovimentacao.ENTRADA, faixa=faixa, quantidade=valor,
+            quantidade_anterior=0, quantidade_nova=valor, seq=faixa_doc["seq"]
+        ))
+    if quantidade:
+        await db.movimentacoes.insert_many([m.dict() for m in movimentacoes if m.quantidade])
+    await desbloquear_faixas(produto_id)
+    await incrementar_versao_catalogo()
+    return Produto(**produto)
+
+@api_router.delete("/produtos/{produto_id}/contador-distribuido", response_model=Produto)
+async def desativar_contador_distribuido(produto_id: str):
+    if not await bloquear_faixas(produto_id):
+        if not await db.produtos.find_one({"id": produto_id, "faixas_estoque": {"$gt": 0}}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="Produto não usa contador distribuído")
+        raise _erro_faixas_indisponiveis()
+    
+    # Fecha e zera cada faixa em uma única escrita: o que já foi escrito entra na soma e o
+    # que chegar depois é recusado, então nenhuma escrita se perde entre a soma e a troca.
+    # O saldo volta ao global como transferência, fechando a cadeia de cada faixa em 0.
+    comum = {
+        "produto_id": produto_id,
+        "motivo": MotivoMovimentacao.TRANSFERENCIA,
+        "observacoes": "Desativação do contador distribuído",
+        "transferencia_id": str(uuid.uuid4()),
+    }
+    movimentacoes = []
+    total = 0.0
+    for faixa in await db.estoque_faixas.distinct("faixa", {"produto_id": produto_id, "fechada": {"$ne": True}}):
+        faixa_doc = await db.estoque_faixas.find_one_and_update(
+            {"produto_id": produto_id, "faixa": faixa, "fechada": {"$ne": True}},
+            {"$set": {"quantidade": 0, "fechada": True}, "$inc": {"seq": 1}},
+            return_document=DOCUMENTO_ANTERIOR
+        )
+        if not faixa_doc or not faixa_doc["quantidade"]:
+            continue
+        total += faixa_doc["quantidade"]
+        movimentacoes.append(MovimentacaoEstoque(
+            **comum, tipo=TipoMovimentacao.SAIDA, faixa=faixa, quantidade=faixa_doc["quantidade"],
+            quantidade_anterior=faixa_doc["quantidade"], quantidade_nova=0, seq=faixa_doc.get("seq", 0) + 1
+        ))
+    produto = await db.produtos.find_one_and_update(
+        {"id": produto_id},
+        {"$set": {
+            "faixas_estoque": 0,
+            "faixas_bloqueadas_ate": None,
+            "quantidade_atual": total,
+            "updated_at": datetime.utcnow()
+        }, "$inc": {"seq_movimentacoes": 1}},
+        return_document=DOCUMENTO_ATUALIZADO
+    )
+    if movimentacoes:
+        movimentacoes.append(MovimentacaoEstoque(
+            **comum, tipo=TipoMovimentacao.ENTRADA, quantidade=total,
+            quantidade_anterior=0, quantidade_nova=total, seq=produto["seq_movimentacoes"]
+        ))
+        await db.movimentacoes.insert_many([m.dict() for m in movimentacoes])
+    await incrementar_versao_catalogo()
+    return Produto(**produto)
+
+# Reservas de estoque (carrinhos e pedidos pendentes)
+class RodaTemporizadora:
+    """Roda de temporização: agendar, cancelar e avançar custam O(1) por item.
+
+    Cada posição corresponde a `resolucao` segundos; prazos maiores que uma volta
+    completa guardam quantas voltas ainda faltam.
+    """
+
+    def __init__(self, posicoes: int = 3600, resolucao: float = 1.0):
+        self.resolucao = resolucao
+        self.posicoes: List[Dict[str, int]] = [{} for _ in range(posicoes)]
+        self.indice: Dict[str, int] = {}
+        self.atual = 0
+
+    def agendar(self, chave: str, expira_em: datetime):
+        self.cancelar(chave)
+        atraso = (expira_em - datetime.utcnow()).total_seconds()
+        ticks = max(1, math.ceil(atraso / self.resolucao))
+        posicao = (self.atual + ticks) % len(self.posicoes)
+        self.posicoes[posicao][chave] = (ticks - 1) // len(self.posicoes)
+        self.indice[chave] = posicao
+
+    def cancelar(self, chave: str):
+        posicao = self.indice.pop(chave, None)
+        if posicao is not None:
+            self.posicoes[posicao].pop(chave, None)
+
+    def avancar(self) -> List[str]:
+        self.atual = (self.atual + 1) % len(self.posicoes)
+        posicao = self.posicoes[self.atual]
+        vencidas = []
+        for chave, voltas in list(posicao.items()):
+            if voltas == 0:
+                vencidas.append(chave)
+                del posicao[chave]
+                del self.indice[chave]
+            else:
+                posicao[chave] = voltas - 1
+        return vencidas
+
+roda_reservas = RodaTemporizadora()
+VARREDURA_RESERVAS_TICKS = 60
+
+async def _zerar_residuo(colecao: str, filtro: dict):
+    # Somas e subtrações de frações (ex.: 0.1 + 0.2 - 0.3) deixam resíduos que
+    # impediriam checagens de "sem reservas"; abaixo da tolerância o saldo vira 0
+    await db[colecao].update_one(
+        {**filtro, "quantidade_reservada": {"$gt": -TOLERANCIA_QUANTIDADE, "$lt": TOLERANCIA_QUANTIDADE, "$ne": 0}},
+        {"$set": {"quantidade_reservada": 0}}
+    )
+
+async def devolver_reservado(reserva: dict):
+    """Devolve a quantidade da reserva ao disponível do produto e, se houver, do depósito."""
+    filtros = [("produtos", {"id": reserva["produto_id"]})]
+    if reserva.get("deposito_id"):
+        filtros.append(("estoques", {"deposito_id": reserva["deposito_id"], "produto_id": reserva["produto_id"]}))
+    for colecao, filtro in filtros:
+        await db[colecao].update_one(filtro, {"$inc": {"quantidade_reservada": -reserva["quantidade"]}})
+        await _zerar_residuo(colecao, filtro)
+
+async def finalizar_reserva(reserva_id: str, status: StatusReserva, filtro_extra: Optional[dict] = None) -> Optional[dict]:
+    """Libera o saldo reservado; só a primeira finalização de uma reserva ativa tem efeito."""
+    agora = datetime.utcnow()
+    reserva = await db.reservas.find_one_and_update(
+        {"id": reserva_id, "status": StatusReserva.ATIVA, **(filtro_extra or {})},
+        {"$set": {
+            "status": status,
+            "finalizada_em": agora,
+            "remover_em": agora + timedelta(seconds=RETENCAO_RESERVAS_SEGUNDOS)
+        }},
+        return_document=DOCUMENTO_ATUALIZADO
+    )
+    roda_reservas.cancelar(reserva_id)
+    if reserva:
+        await devolver_reservado(reserva)
+        await incrementar_versao_catalogo()
+    return reserva
+
+async def varrer_reservas_expiradas():
+    # Rede de segurança para reservas agendadas em outro processo ou antes de um reinício
+    async for reserva in db.reservas.find(
+        {"status": StatusReserva.ATIVA, "expira_em": {"$lte": datetime.utcnow()}}, {"id": 1}
+    ):
+        await finalizar_reserva(reserva["id"], StatusReserva.EXPIRADA)
+
+async def tarefa_expiracao_reservas():
+    loop = asyncio.get_running_loop()
+    proximo = loop.time()
+    ticks = 0
+    while True:
+        proximo += roda_reservas.resolucao
+        await asyncio.sleep(max(0, proximo - loop.time()))
+        ticks += 1
+        try:
+            for reserva_id in roda_reservas.avancar():
+                await finalizar_reserva(
+                    reserva_id, StatusReserva.EXPIRADA, {"expira_em": {"$lte": datetime.utcnow()}}
+                )
+            if ticks % VARREDURA_RESERVAS_TICKS == 0:
+                await varrer_reservas_expiradas()
+        except Exception:
+            logger.exception("Erro ao expirar reservas")
+
+async def iniciar_reservas():
+    # Reservas gravadas antes de remover_em ser exclusivo das finalizadas: o TTL
+    # poderia apagá-las ainda ativas, sem devolver o saldo reservado
+    await db.reservas.update_many(
+        {"status": StatusReserva.ATIVA, "remover_em": {"$ne": None}},
+        {"$unset": {"remover_em": ""}}
+    )
+    await varrer_reservas_expiradas()
+    async for reserva in db.reservas.find({"status": StatusReserva.ATIVA}, {"id": 1, "expira_em": 1}):
+        roda_reservas.agendar(reserva["id"], reserva["expira_em"])
+    app.state.expiracao_reservas = asyncio.create_task(tarefa_expiracao_reservas())
+
+@api_router.post("/reservas", response_model=Reserva)
+async def criar_reserva(reserva_create: ReservaCreate):
+    quantidade = reserva_create.quantidade
+    # Produtos controlados por depósitos reservam em um depósito, que é baixado na
+    # confirmação; os demais não têm saldo por depósito para reservar
+    if reserva_create.deposito_id:
+        await obter_deposito_ativo(reserva_create.deposito_id)
+    
+    # Reserva só se quantidade_atual - quantidade_reservada cobrir o pedido, em uma única escrita
+    produto = await db.produtos.find_one_and_update(
+        {
+            "id": reserva_create.produto_id,
+            "ativo": True,
+            "faixas_estoque": {"$in": [0, None]},
+            "usa_depositos": True if reserva_create.deposito_id else {"$ne": True},
+            "$expr": {"$gte": [
+                {"$subtract": ["$quantidade_atual", {"$ifNull": ["$quantidade_reservada", 0]}]},
+                quantidade
+            ]}
+        },
+        {"$inc": {"quantidade_reservada": quantidade}}
+    )
+    if not produto:
+        produto = await db.produtos.find_one({"id": reserva_create.produto_id, "ativo": True})
+        if not produto:
+            raise HTTPException(status_code=404, detail="Produto não encontrado")
+        if produto.get("faixas_estoque"):
+            raise HTTPException(status_code=400, detail="Produto com contador distribuído não aceita reservas")
+        if produto.get("usa_depositos") and not reserva_create.deposito_id:
+            raise HTTPException(status_code=400, detail=ERRO_INFORME_DEPOSITO)
+        if reserva_create.deposito_id and not produto.get("usa_depositos"):
+            raise HTTPException(status_code=400, detail="Produto não é controlado por depósitos")
+        disponivel = produto["quantidade_atual"] - produto.get("quantidade_reservada", 0)
+        raise HTTPException(status_code=400, detail=f"Estoque insuficiente. Disponível: {disponivel}")
+    
+    expira_em = datetime.utcnow() + timedelta(seconds=reserva_create.ttl_segundos)
+    reserva = Reserva(
+        produto_id=reserva_create.produto_id,
+        quantidade=quantidade,
+        referencia=reserva_create.referencia,
+        usuario=reserva_create.usuario,
+        deposito_id=reserva_create.deposito_id,
+        expira_em=expira_em
+    )
+    if reserva.deposito_id:
+        # O depósito também separa a quantidade, com a mesma guarda do total
+        estoque = await db.estoques.find_one_and_update(
+            {
+                "deposito_id": reserva.deposito_id,
+                "produto_id": reserva.produto_id,
+                "$expr": {"$gte": [
+                    {"$subtract": ["$quantidade", {"$ifNull": ["$quantidade_reservada", 0]}]},
+                    quantidade
+                ]}
+            },
+            {"$inc": {"quantidade_reservada": quantidade}}
+        )
+        if not estoque:
+            await db.produtos.update_one({"id": reserva.produto_id}, {"$inc": {"quantidade_reservada": -quantidade}})
+            await _zerar_residuo("produtos", {"id": reserva.produto_id})
+            atual = await db.estoques.find_one({"deposito_id": reserva.deposito_id, "produto_id": reserva.produto_id})
+            disponivel = atual["quantidade"] - atual.get("quantidade_reservada", 0) if atual else 0
+            raise HTTPException(status_code=400, detail=f"Estoque insuficiente no depósito. Disponível: {disponivel}")
+    try:
+        await db.reservas.insert_one(reserva.dict())
+    except Exception:
+        await devolver_reservado(reserva.dict())
+        raise
+    roda_reservas.agendar(reserva.id, expira_em)
+    await incrementar_versao_catalogo()
+    return reserva
+
+@api_router.get("/reservas/{reserva_id}", response_model=Reserva)
+async def obter_reserva(reserva_id: str):
+    reserva = await db.reservas.find_one({"id": reserva_id})
+    if not reserva:
+        raise HTTPException(status_code=404, detail="Reserva não encontrada")
+    return Reserva(**reserva)
+
+@api_router.post("/reservas/{reserva_id}/confirmar", response_model=MovimentacaoEstoque)
+async def confirmar_reserva(reserva_id: str, confirmacao: Optional[ReservaConfirmacao] = None):
+    confirmacao = confirmacao or ReservaConfirmacao()
+    agora = datetime.utcnow()
+    reserva = await db.reservas.find_one_and_update(
+        {"id": reserva_id, "status": StatusReserva.ATIVA, "expira_em": {"$gt": agora}},
+        {"$set": {
+            "status": StatusReserva.CONFIRMADA,
+            "finalizada_em": agora,
+            "remover_em": agora + timedelta(seconds=RETENCAO_RESERVAS_SEGUNDOS)
+        }},
+        return_document=DOCUMENTO_ATUALIZADO
+    )
+    if not reserva:
+        if not await db.reservas.find_one({"id": reserva_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Reserva não encontrada")
+        raise HTTPException(status_code=400, detail="Reserva expirada ou já finalizada")
+    roda_reservas.cancelar(reserva_id)
+    
+    # Baixa o estoque e a reserva juntos
+    quantidade = reserva["quantidade"]
+    produto = await db.produtos.find_one_and_update(
+        {
+            "id": reserva["produto_id"],
+            "faixas_estoque": {"$in": [0, None]},
+            "quantidade_atual": {"$gte": quantidade}
+        },
+        {
+            "$inc": {"quantidade_atual": -quantidade, "quantidade_reservada": -quantidade, "seq_movimentacoes": 1},
+            "$set": {"updated_at": datetime.utcnow()}
+        },
+        return_document=DOCUMENTO_ATUALIZADO
+    )
+    
+    async def reativar_reserva():
+        await db.reservas.update_one(
+            {"id": reserva_id},
+            {"$set": {"status": StatusReserva.ATIVA, "finalizada_em": None}, "$unset": {"remover_em": ""}}
+        )
+        roda_reservas.agendar(reserva_id, reserva["expira_em"])
+    
+    if not produto:
+        # Saldo ajustado por fora da reserva (ex.: auditoria) ou produto com faixas: devolve a reserva
+        await reativar_reserva()
+        raise HTTPException(status_code=400, detail="Estoque insuficiente para confirmar a reserva")
+    await _zerar_residuo("produtos", {"id": reserva["produto_id"]})
+    quantidade_nova = produto["quantidade_atual"]
+    seq = produto["seq_movimentacoes"]
+    
+    if reserva.get("deposito_id"):
+        # A saída também baixa o depósito da reserva; a movimentação segue a cadeia do depósito
+        filtro_estoque = {"deposito_id": reserva["deposito_id"], "produto_id": reserva["produto_id"]}
+        estoque = await db.estoques.find_one_and_update(
+            {**filtro_estoque, "quantidade": {"$gte": quantidade}},
+            {
+                "$inc": {"quantidade": -quantidade, "quantidade_reservada": -quantidade, "seq": 1},
+                "$set": {"updated_at": datetime.utcnow()}
+            },
+            return_document=DOCUMENTO_ATUALIZADO
+        )
+        if not estoque:
+            await db.produtos.update_one(
+                {"id": reserva["produto_id"]},
+                {"$inc": {"quantidade_atual": quantidade, "quantidade_reservada": quantidade}}
+            )
+            await reativar_reserva()
+            raise HTTPException(status_code=400, detail="Estoque insuficiente no depósito para confirmar a reserva")
+        await _zerar_residuo("estoques", filtro_estoque)
+        quantidade_nova = estoque["quantidade"]
+        seq = estoque["seq"]
+    
+    movimentacao_obj = MovimentacaoEstoque(
+        produto_id=reserva["produto_id"],
+        tipo=TipoMovimentacao.SAIDA,
+        motivo=MotivoMovimentacao.VENDA,
+        quantidade=quantidade,
+        quantidade_anterior=quantidade_nova + quantidade,
+        quantidade_nova=quantidade_nova,
+        deposito_id=reserva.get("deposito_id"),
+        seq=seq,
+        preco_unitario=confirmacao.preco_unitario if confirmacao.preco_unitario is not None else produto.get("preco_venda", 0),
+        observacoes=confirmacao.observacoes or f"Reserva {reserva_id}",
+        usuario=reserva.get("usuario")
+    )
+    await db.movimentacoes.insert_one(movimentacao_obj.dict())
+    await db.reservas.update_one({"id": reserva_id}, {"$set": {"movimentacao_id": movimentacao_obj.id}})
+    await incrementar_versao_catalogo()
+    return movimentacao_obj
+
+@api_router.post("/reservas/{reserva_id}/liberar", response_model=Reserva)
+async def liberar_reserva(reserva_id: str):
+    reserva = await finalizar_reserva(reserva_id, StatusReserva.LIBERADA)
+    if not reserva:
+        if not await db.reservas.find_one({"id": reserva_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Reserva não encontrada")
+        raise HTTPException(status_code=400, detail="Reserva já finalizada")
+    return Reserva(**reserva)
+
+@api_router.get("/produtos/{produto_id}/disponibilidade", response_model=Disponibilidade)
+async def obter_disponibilidade(produto_id: str):
+    produto = await db.produtos.find_one(
+        {"id": produto_id, "ativo": True},
+        {"_id": 0, "quantidade_atual": 1, "quantidade_reservada": 1}
+    )
+    if not produto:
+        raise HTTPException(status_code=404, detail="Produto não encontrado")
+    reservada = produto.get("quantidade_reservada", 0)
+    return Disponibilidade(
+        produto_id=produto_id,
+        quantidade_atual=produto["quantidade_atual"],
+        quantidade_reservada=reservada,
+        disponivel=produto["quantidade_atual"] - reservada
+    )
+
 # Relatórios e Dashboards
 @api_router.get("/dashboard")
-async def obter_dashboard():
+async def obter_dashboard(request: Request, response: Response, deposito_id: Optional[str] = None):
+    etag = await etag_catalogo(request)
+    if etag_corresponde(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cabecalhos_cache(etag))
+    response.headers.update(cabecalhos_cache(etag))
+    
+    if deposito_id:
+        return await obter_dashboard_deposito(deposito_id)
+    
     # Contadores básicos
     total_produtos = await db.produtos.count_documents({"ativo": True})
     produtos_sem_estoque = await db.produtos.count_documents({"quantidade_atual": 0, "ativo": True})
     
     # Produtos com estoque baixo
     produtos_estoque_baixo = await db.produtos.find({
-        "quantidade_atual": {"$gt": 0, "$lte": "$quantidade_minima"}, 
+        "quantidade_atual": {"$gt": 0},
+        "$expr": {"$lte": ["$quantidade_atual", "$quantidade_minima"]},
         "ativo": True
     }).to_list(1000)
     
@@ -271,6 +1435,61 @@ async def obter_dashboard():
         "categorias": categorias
     }
 
+def _pipeline_estoque_deposito(deposito_id: str) -> list:
+    return [
+        {"$match": {"deposito_id": deposito_id}},
+        {"$lookup": {"from": "produtos", "localField": "produto_id", "foreignField": "id", "as": "produto"}},
+        {"$unwind": "$produto"},
+        {"$match": {"produto.ativo": True}},
+    ]
+
+FILTRO_ESTOQUE_BAIXO_DEPOSITO = {
+    "quantidade": {"$gt": 0},
+    "$expr": {"$lte": ["$quantidade", "$produto.quantidade_minima"]}
+}
+
+def pipeline_estoque_baixo_deposito(deposito_id: str) -> list:
+    return _pipeline_estoque_deposito(deposito_id) + [{"$match": FILTRO_ESTOQUE_BAIXO_DEPOSITO}]
+
+def _produto_no_deposito(item: dict) -> Produto:
+    return Produto(**{**item["produto"], "quantidade_atual": item["quantidade"]})
+
+async def obter_dashboard_deposito(deposito_id: str):
+    await obter_deposito_ativo(deposito_id)
+    
+    pipeline = _pipeline_estoque_deposito(deposito_id) + [
+        {"$facet": {
+            "total": [{"$count": "total"}],
+            "sem_estoque": [{"$match": {"quantidade": 0}}, {"$count": "total"}],
+            "estoque_baixo_total": [{"$match": FILTRO_ESTOQUE_BAIXO_DEPOSITO}, {"$count": "total"}],
+            "zerados": [{"$match": {"quantidade": 0}}, {"$limit": 1000}],
+            "estoque_baixo": [{"$match": FILTRO_ESTOQUE_BAIXO_DEPOSITO}, {"$limit": 1000}],
+            "categorias": [
+                {"$group": {"_id": "$produto.categoria", "total": {"$sum": 1}, "quantidade_total": {"$sum": "$quantidade"}}},
+                {"$sort": {"total": -1}}
+            ],
+        }}
+    ]
+    resultado = (await db.estoques.aggregate(pipeline).to_list(1))[0]
+    
+    def contagem(chave):
+        return resultado[chave][0]["total"] if resultado[chave] else 0
+    
+    ultimas_movimentacoes = await db.movimentacoes.find(
+        {"deposito_id": deposito_id}
+    ).sort("created_at", -1).limit(10).to_list(10)
+    
+    return {
+        "deposito_id": deposito_id,
+        "total_produtos": contagem("total"),
+        "produtos_sem_estoque": contagem("sem_estoque"),
+        "produtos_estoque_baixo": contagem("estoque_baixo_total"),
+        "produtos_zerados": [_produto_no_deposito(i) for i in resultado["zerados"]],
+        "estoque_baixo": [_produto_no_deposito(i) for i in resultado["estoque_baixo"]],
+        "ultimas_movimentacoes": [MovimentacaoEstoque(**m) for m in ultimas_movimentacoes],
+        "categorias": resultado["categorias"]
+    }
+
 @api_router.get("/categorias")
 async def listar_categorias():
     pipeline = [
@@ -281,11 +1500,730 @@ async def listar_categorias():
     categorias = await db.produtos.aggregate(pipeline).to_list(1000)
     return [cat["_id"] for cat in categorias]
 
+# Auditoria do livro de movimentações
+# Cada cadeia (global, por depósito, por faixa) em sequência; created_at só desempata registros sem seq
+ORDEM_AUDITORIA = [("produto_id", 1), ("deposito_id", 1), ("faixa", 1), ("seq", 1), ("created_at", 1)]
+LOTE_AUDITORIA = 1000
+
+class DivergenciaEstoque(BaseModel):
+    produto_id: str
+    tipo: str  # cadeia, calculo, saldo, depositos ou produto_inexistente
+    movimentacao_id: Optional[str] = None
+    esperado: float = 0
+    encontrado: float = 0
+
+class ResultadoAuditoria(BaseModel):
+    produtos_verificados: int = 0
+    movimentacoes_verificadas: int = 0
+    total_divergencias: int = 0
+    divergencias: List[DivergenciaEstoque] = []
+    ajustes_criados: int = 0
+
+def faixas_produto_id(partes: int):
+    """Divide o espaço de ids (UUID em hexadecimal) em faixas [inicio, fim)."""
+    partes = max(1, min(partes, 256))
+    limites = [f"{(i * 256) // partes:02x}" for i in range(1, partes)]
+    return list(zip([None] + limites, limites + [None]))
+
+def _filtro_faixa(campo: str, inicio: Optional[str], fim: Optional[str]) -> dict:
+    condicao = {}
+    if inicio is not None:
+        condicao["$gte"] = inicio
+    if fim is not None:
+        condicao["$lt"] = fim
+    return {campo: condicao} if condicao else {}
+
+async def _proximo(cursor):
+    try:
+        return await cursor.next()
+    except StopAsyncIteration:
+        return None
+
+def _registrar_divergencia(resultado: ResultadoAuditoria, divergencia: DivergenciaEstoque, limite: int):
+    resultado.total_divergencias += 1
+    if len(resultado.divergencias) < limite:
+        resultado.divergencias.append(divergencia)
+
+async def _gravar_ajustes(ajustes: List[MovimentacaoEstoque]) -> int:
+    """Aplica as correções da auditoria e devolve quantas foram gravadas.
+
+    O $inc é condicional: se o produto passou a usar faixas ou depósitos desde a
+    leitura, a correção é descartada. O saldo anterior registrado é o lido na
+    própria escrita, então a cadeia do livro continua fechando.
+    """
+    gravados = []
+    for ajuste in ajustes:
+        delta = ajuste.quantidade_nova - ajuste.quantidade_anterior
+        produto = await db.produtos.find_one_and_update(
+            {"id": ajuste.produto_id, "faixas_estoque": {"$in": [0, None]}, "usa_depositos": {"$ne": True}},
+            {"$inc": {"quantidade_atual": delta, "seq_movimentacoes": 1}, "$set": {"updated_at": ajuste.created_at}},
+            return_document=DOCUMENTO_ATUALIZADO
+        )
+        if not produto:
+            continue
+        ajuste.quantidade_nova = produto["quantidade_atual"]
+        ajuste.quantidade_anterior = ajuste.quantidade_nova - delta
+        ajuste.seq = produto["seq_movimentacoes"]
+        gravados.append(ajuste)
+    if gravados:
+        await db.movimentacoes.insert_many([a.dict() for a in gravados], ordered=False)
+        await incrementar_versao_catalogo()
+    return len(gravados)
+
+async def _auditar_faixa(inicio, fim, corrigir: bool, resultado: ResultadoAuditoria, limite: int):
+    produtos = db.produtos.find(
+        _filtro_faixa("id", inicio, fim),
+        {"_id": 0, "id": 1, "quantidade_atual": 1, "faixas_estoque": 1, "usa_depositos": 1},
+    ).sort("id", 1).batch_size(LOTE_AUDITORIA)
+    movimentacoes = db.movimentacoes.find(
+        _filtro_faixa("produto_id", inicio, fim),
+        {"_id": 0, "id": 1, "produto_id": 1, "tipo": 1, "motivo": 1,
+         "quantidade": 1, "quantidade_anterior": 1, "quantidade_nova": 1, "deposito_id": 1, "faixa": 1},
+    ).sort(ORDEM_AUDITORIA).batch_size(LOTE_AUDITORIA)
+
+    ajustes: List[MovimentacaoEstoque] = []
+    mov = await _proximo(movimentacoes)
+    produto = await _proximo(produtos)
+
+    while produto is not None or mov is not None:
+        # Movimentações cujo produto não existe mais (ids menores que o produto corrente)
+        if mov is not None and (produto is None or mov["produto_id"] < produto["id"]):
+            orfao = mov["produto_id"]
+            _registrar_divergencia(resultado, DivergenciaEstoque(produto_id=orfao, tipo="produto_inexistente"), limite)
+            while mov is not None and mov["produto_id"] == orfao:
+                resultado.movimentacoes_verificadas += 1
+                mov = await _proximo(movimentacoes)
+            continue
+
+        produto_id = produto["id"]
+        saldo_cadeia = 0.0  # saldo total do produto segundo os registros
+        saldo_real = 0.0    # soma das movimentações efetivas
+        cadeias_locais = {}  # último quantidade_nova de cada depósito ou faixa
+        while mov is not None and mov["produto_id"] == produto_id:
+            resultado.movimentacoes_verificadas += 1
+            delta = mov["quantidade"] if mov["tipo"] == TipoMovimentacao.ENTRADA else -mov["quantidade"]
+            if mov.get("deposito_id") is not None:
+                chave = ("deposito", mov["deposito_id"])
+                esperado = cadeias_locais.get(chave, 0.0)
+            elif mov.get("faixa") is not None:
+                chave = ("faixa", mov["faixa"])
+                esperado = cadeias_locais.get(chave, 0.0)
+            elif mov["motivo"] == MotivoMovimentacao.AJUSTE:
+                # Ajustes (ex.: correções da auditoria) partem do saldo encontrado e reiniciam a cadeia
+                chave = None
+                esperado = mov["quantidade_anterior"]
+            else:
+                chave = None
+                esperado = saldo_cadeia
+            if abs(mov["quantidade_anterior"] - esperado) > TOLERANCIA_QUANTIDADE:
+                _registrar_divergencia(resultado, DivergenciaEstoque(
+                    produto_id=produto_id, tipo="cadeia", movimentacao_id=mov["id"],
+                    esperado=esperado, encontrado=mov["quantidade_anterior"]
+                ), limite)
+            if abs(mov["quantidade_anterior"] + delta - mov["quantidade_nova"]) > TOLERANCIA_QUANTIDADE:
+                _registrar_divergencia(resultado, DivergenciaEstoque(
+                    produto_id=produto_id, tipo="calculo", movimentacao_id=mov["id"],
+                    esperado=mov["quantidade_anterior"] + delta, encontrado=mov["quantidade_nova"]
+                ), limite)
+            if chave is not None:
+                # Movimentações por depósito ou faixa registram o saldo do local e somam ao total;
+                # a cadeia global só anda com movimentações globais (a ativação de faixas zera o
+                # global e a desativação o recompõe, e produtos com depósitos começam em 0)
+                cadeias_locais[chave] = mov["quantidade_nova"]
+                saldo_real += delta
+            else:
+                # Ajustes funcionam como contagem de inventário: fixam o saldo real
+                if mov["motivo"] == MotivoMovimentacao.AJUSTE:
+                    saldo_real = mov["quantidade_nova"]
+                else:
+                    saldo_real += delta
+                saldo_cadeia = mov["quantidade_nova"]
+            mov = await _proximo(movimentacoes)
+
+        resultado.produtos_verificados += 1
+        quantidade_atual = produto.get("quantidade_atual", 0)
+        distribuido = bool(produto.get("faixas_estoque"))
+        if distribuido:
+            quantidade_atual = (await somar_faixas([produto_id])).get(produto_id, 0)
+        por_deposito = bool(produto.get("usa_depositos"))
+        if por_deposito:
+            soma_depositos = sum(saldo for (origem, _), saldo in cadeias_locais.items() if origem == "deposito")
+            if abs(quantidade_atual - soma_depositos) > TOLERANCIA_QUANTIDADE:
+                _registrar_divergencia(resultado, DivergenciaEstoque(
+                    produto_id=produto_id, tipo="depositos", esperado=soma_depositos, encontrado=quantidade_atual
+                ), limite)
+        if abs(quantidade_atual - saldo_real) > TOLERANCIA_QUANTIDADE:
+            _registrar_divergencia(resultado, DivergenciaEstoque(
+                produto_id=produto_id, tipo="saldo", esperado=saldo_real, encontrado=quantidade_atual
+            ), limite)
+            # Contador distribuído e depósitos não recebem correção automática: um AJUSTE
+            # global mudaria o total sem mudar as faixas ou depósitos que o compõem
+            if corrigir and not distribuido and not por_deposito:
+                ajustes.append(MovimentacaoEstoque(
+                    produto_id=produto_id,
+                    tipo=TipoMovimentacao.ENTRADA if saldo_real > quantidade_atual else TipoMovimentacao.SAIDA,
+                    motivo=MotivoMovimentacao.AJUSTE,
+                    quantidade=abs(saldo_real - quantidade_atual),
+                    quantidade_anterior=quantidade_atual,
+                    quantidade_nova=saldo_real,
+                    observacoes="Correção automática da auditoria de estoque",
+                    usuario="Auditoria",
+                ))
+                if len(ajustes) >= LOTE_AUDITORIA:
+                    resultado.ajustes_criados += await _gravar_ajustes(ajustes)
+                    ajustes = []
+        produto = await _proximo(produtos)
+
+    resultado.ajustes_criados += await _gravar_ajustes(ajustes)
+
+async def auditar_estoque(paralelismo: int = 4, corrigir: bool = False, limite_divergencias: int = 100) -> ResultadoAuditoria:
+    """Percorre o livro de movimentações por faixas de produto_id e compara com `produtos`.
+
+    Cada faixa é lida em fluxo ordenado por produto e, dentro dele, cadeia a cadeia pelo
+    seq (ORDEM_AUDITORIA), então a memória usada independe do tamanho do livro.
+    """
+    resultado = ResultadoAuditoria()
+    semaforo = asyncio.Semaphore(max(1, paralelismo))
+
+    async def executar(inicio, fim):
+        async with semaforo:
+            await _auditar_faixa(inicio, fim, corrigir, resultado, limite_divergencias)
+
+    await asyncio.gather(*(executar(inicio, fim) for inicio, fim in faixas_produto_id(paralelismo * 4)))
+    return resultado
+
+# Jobs assíncronos (exportações, importações e relatórios pesados)
+LOTE_JOBS = 1000
+LIMITE_ERRO_JOB = 2000
+LIMITE_REJEITADOS_IMPORTACAO = 100
+# Relatório de margens: faixas de produto_id lidas pelo processo filho e produtos
+# devolvidos no resultado (a tabela completa vai para o arquivo do job)
+FAIXAS_RELATORIO_MARGENS = 64
+LIMITE_PRODUTOS_RELATORIO = 100
+
+class TipoJob(str, Enum):
+    EXPORTAR_PRODUTOS = "exportar_produtos"
+    EXPORTAR_MOVIMENTACOES = "exportar_movimentacoes"
+    IMPORTAR_PRODUTOS = "importar_produtos"
+    RECALCULAR_DASHBOARD = "recalcular_dashboard"
+    AUDITAR_ESTOQUE = "auditar_estoque"
+    RELATORIO_MARGENS = "relatorio_margens"
+
+class StatusJob(str, Enum):
+    PENDENTE = "pendente"
+    EXECUTANDO = "executando"
+    CONCLUIDO = "concluido"
+    FALHOU = "falhou"
+
+class Job(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    tipo: TipoJob
+    status: StatusJob = StatusJob.PENDENTE
+    parametros: Dict[str, Any] = {}
+    progresso: float = 0
+    resultado: Optional[Dict[str, Any]] = None
+    erro: Optional[str] = None
+    executor: Optional[str] = None
+    concessao_expira_em: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class JobCreate(BaseModel):
+    tipo: TipoJob
+    parametros: Dict[str, Any] = {}
+
+fila_jobs: "asyncio.Queue[str]" = asyncio.Queue()
+workers_jobs: List[asyncio.Task] = []
+_pool_processos = None
+# Identifica este processo como executor dos jobs que reivindicar
+EXECUTOR_JOBS = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def obter_pool_processos():
+    global _pool_processos
+    if _pool_processos is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # spawn evita herdar as threads do Motor no processo filho
+        _pool_processos = ProcessPoolExecutor(
+            max_workers=JOBS_PROCESSOS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool_processos
+
+async def executar_em_processo(funcao, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(obter_pool_processos(), funcao, *args)
+
+async def atualizar_progresso_job(job_id: str, progresso: float):
+    await db.jobs.update_one({"id": job_id}, {"$set": {"progresso": round(min(progresso, 1.0), 4)}})
+
+async def _coletar_registros(
+    job: Job, colecao: str, filtro: dict, projecao: dict, inicio: float = 0.0, fim: float = 1.0
+) -> List[dict]:
+    # O progresso da coleta ocupa o trecho [inicio, fim] do job, então nunca volta atrás entre coletas
+    total = await db[colecao].count_documents(filtro) or 1
+    registros = []
+    async for doc in db[colecao].find(filtro, projecao).batch_size(LOTE_JOBS):
+        registros.append(doc)
+        if len(registros) % LOTE_JOBS == 0:
+            await atualizar_progresso_job(job.id, inicio + (fim - inicio) * len(registros) / total)
+    return registros
+
+async def _job_exportar(job: Job, colecao: str, modelo) -> dict:
+    filtro = job.parametros.get("filtro", {})
+    colunas = list(modelo.__fields__.keys())
+    total = await db[colecao].count_documents(filtro) or 1
+    DIRETORIO_EXPORTACOES.mkdir(parents=True, exist_ok=True)
+    caminho = DIRETORIO_EXPORTACOES / f"{job.id}.csv"
+    
+    # O cursor é escrito em lotes direto no arquivo: a memória usada independe do tamanho da coleção
+    linhas = 0
+    with open(caminho, "w", newline="", encoding="utf-8") as arquivo:
+        escritor = csv.DictWriter(arquivo, fieldnames=colunas, extrasaction="ignore")
+        escritor.writeheader()
+        lote = []
+        async for doc in db[colecao].find(filtro, {"_id": 0}).batch_size(LOTE_JOBS):
+            lote.append(doc)
+            if len(lote) >= LOTE_JOBS:
+                await asyncio.to_thread(escritor.writerows, lote)
+                linhas += len(lote)
+                lote = []
+                await atualizar_progresso_job(job.id, linhas / total)
+        if lote:
+            await asyncio.to_thread(escritor.writerows, lote)
+            linhas += len(lote)
+    return {"arquivo": caminho.name, "linhas": linhas}
+
+def _ler_lote_csv(leitor, tamanho: int) -> List[dict]:
+    lote = []
+    for linha in leitor:
+        lote.append(linha)
+        if len(lote) >= tamanho:
+            break
+    return lote
+
+async def _job_importar_produtos(job: Job) -> dict:
+    # As linhas ficam no arquivo enviado, não no documento do job (limite de 16 MB do MongoDB)
+    caminho = DIRETORIO_IMPORTACOES / job.parametros["arquivo"]
+    tamanho = caminho.stat().st_size or 1
+    importados = 0
+    ignorados = 0
+    rejeitados = 0
+    erros = []
+    lidas = 0
+    try:
+        with open(caminho, newline="", encoding="utf-8-sig") as arquivo:
+            leitor = csv.DictReader(arquivo)
+            while True:
+                linhas = await asyncio.to_thread(_ler_lote_csv, leitor, LOTE_JOBS)
+                if not linhas:
+                    break
+                # Colunas vazias ficam com o valor padrão; colunas extras (ex.: de uma exportação) são ignoradas.
+                # Linhas inválidas são contadas e relatadas sem interromper a importação.
+                lote = []
+                for numero, linha in enumerate(linhas, start=lidas + 2):
+                    try:
+                        lote.append(ProdutoCreate(**{k: v for k, v in linha.items() if k and v not in ("", None)}))
+                    except ValidationError as e:
+                        rejeitados += 1
+                        if len(erros) < LIMITE_REJEITADOS_IMPORTACAO:
+                            erros.append({"linha": numero, "erro": str(e)[:500]})
+                lidas += len(linhas)
+                existentes = await db.produtos.distinct(
+                    "nome", {"nome": {"$in": [p.nome for p in lote]}, "ativo": True}
+                )
+                nomes = set(existentes)
+                novos = []
+                for produto in lote:
+                    if produto.nome in nomes:
+                        ignorados += 1
+                        continue
+                    nomes.add(produto.nome)
+                    novos.append(Produto(**produto.dict(), seq_movimentacoes=1 if produto.quantidade_atual > 0 else 0))
+                if novos:
+                    await db.produtos.insert_many([p.dict() for p in novos], ordered=False)
+                    await db.historico_precos.insert_many([
+                        PrecoHistorico(
+                            produto_id=p.id,
+                            preco_compra=p.preco_compra,
+                            preco_venda=p.preco_venda,
+                            origem=OrigemPreco.IMPORTACAO,
+                            vigente_desde=p.created_at
+                        ).dict()
+                        for p in novos
+                    ], ordered=False)
+                    iniciais = [
+                        MovimentacaoEstoque(
+                            produto_id=p.id,
+                            tipo=TipoMovimentacao.ENTRADA,
+                            motivo=MotivoMovimentacao.INICIAL,
+                            quantidade=p.quantidade_atual,
+                            quantidade_anterior=0,
+                            quantidade_nova=p.quantidade_atual,
+                            preco_unitario=p.preco_compra,
+                            seq=1
+                        ).dict()
+                        for p in novos if p.quantidade_atual > 0
+                    ]
+                    if iniciais:
+                        await db.movimentacoes.insert_many(iniciais, ordered=False)
+                    importados += len(novos)
+                # Progresso pela posição no arquivo binário subjacente (o texto é lido em blocos)
+                await atualizar_progresso_job(job.id, arquivo.buffer.tell() / tamanho)
+    finally:
+        caminho.unlink(missing_ok=True)
+    if importados:
+        await incrementar_versao_catalogo()
+    return {"importados": importados, "ignorados": ignorados, "rejeitados": rejeitados, "erros": erros}
+
+async def _job_recalcular_dashboard(job: Job) -> dict:
+    import relatorios
+
+    produtos = await _coletar_registros(
+        job, "produtos", {"ativo": True},
+        {"_id": 0, "id": 1, "categoria": 1, "quantidade_atual": 1,
+         "quantidade_minima": 1, "preco_compra": 1, "preco_venda": 1},
+        fim=0.3
+    )
+    filtro_mov = {}
+    if job.parametros.get("desde"):
+        filtro_mov["created_at"] = {"$gte": datetime.fromisoformat(job.parametros["desde"])}
+    movimentacoes = await _coletar_registros(
+        job, "movimentacoes", filtro_mov,
+        {"_id": 0, "tipo": 1, "motivo": 1, "quantidade": 1, "preco_unitario": 1},
+        inicio=0.3, fim=0.9
+    )
+    return await executar_em_processo(relatorios.resumo_estoque, produtos, movimentacoes)
+
+async def _job_relatorio_margens(job: Job) -> dict:
+    import relatorios
+
+    filtro_produtos = {}
+    if job.parametros.get("categoria"):
+        filtro_produtos["categoria"] = job.parametros["categoria"]
+
+    # Valores simples: o filtro é serializado para o processo filho
+    filtro_mov = {"motivo": MotivoMovimentacao.VENDA.value, "tipo": TipoMovimentacao.SAIDA.value}
+    periodo_mov = {}
+    if job.parametros.get("inicio"):
+        periodo_mov["$gte"] = datetime.fromisoformat(job.parametros["inicio"])
+    if job.parametros.get("fim"):
+        periodo_mov["$lt"] = datetime.fromisoformat(job.parametros["fim"])
+    if periodo_mov:
+        filtro_mov["created_at"] = periodo_mov
+
+    # O filtro por categoria é aplicado no join com os produtos, evitando $in gigantes
+    filtro_precos = {}
+    if periodo_mov.get("$lt"):
+        filtro_precos["vigente_desde"] = {"$lt": periodo_mov["$lt"]}
+
+    # O processo filho lê o banco faixa a faixa de produto_id: o livro não passa
+    # pelo processo da API e só os totais de cada faixa ficam em memória
+    faixas = [
+        (_filtro_faixa("id", inicio, fim), _filtro_faixa("produto_id", inicio, fim))
+        for inicio, fim in faixas_produto_id(int(job.parametros.get("partes", FAIXAS_RELATORIO_MARGENS)))
+    ]
+    DIRETORIO_EXPORTACOES.mkdir(parents=True, exist_ok=True)
+    return await executar_em_processo(
+        relatorios.margens_banco, job.id, faixas, filtro_produtos, filtro_mov, filtro_precos,
+        job.parametros.get("periodo", "M"), LIMITE_PRODUTOS_RELATORIO, str(DIRETORIO_EXPORTACOES / f"{job.id}.csv")
+    )
+
+async def _job_auditar_estoque(job: Job) -> dict:
+    resultado = await auditar_estoque(
+        paralelismo=int(job.parametros.get("paralelismo", 4)),
+        corrigir=bool(job.parametros.get("corrigir", False)),
+        limite_divergencias=int(job.parametros.get("limite_divergencias", 100))
+    )
+    return resultado.dict()
+
+async def executar_job(job: Job) -> dict:
+    if job.tipo == TipoJob.EXPORTAR_PRODUTOS:
+        return await _job_exportar(job, "produtos", Produto)
+    if job.tipo == TipoJob.EXPORTAR_MOVIMENTACOES:
+        return await _job_exportar(job, "movimentacoes", MovimentacaoEstoque)
+    if job.tipo == TipoJob.IMPORTAR_PRODUTOS:
+        return await _job_importar_produtos(job)
+    if job.tipo == TipoJob.RECALCULAR_DASHBOARD:
+        return await _job_recalcular_dashboard(job)
+    if job.tipo == TipoJob.RELATORIO_MARGENS:
+        return await _job_relatorio_margens(job)
+    return await _job_auditar_estoque(job)
+
+async def renovar_concessao_job(job_id: str):
+    # Enquanto o job roda, a concessão é renovada bem antes de expirar
+    while True:
+        await asyncio.sleep(JOBS_CONCESSAO_SEGUNDOS / 3)
+        try:
+            await db.jobs.update_one(
+                {"id": job_id, "executor": EXECUTOR_JOBS, "status": StatusJob.EXECUTANDO},
+                {"$set": {"concessao_expira_em": datetime.utcnow() + timedelta(seconds=JOBS_CONCESSAO_SEGUNDOS)}}
+            )
+        except Exception:
+            logger.exception("Erro ao renovar a concessão do job %s", job_id)
+
+async def worker_jobs():
+    while True:
+        job_id = await fila_jobs.get()
+        try:
+            # Reivindica o job de forma atômica: outro processo pode ter pego antes
+            agora = datetime.utcnow()
+            doc = await db.jobs.find_one_and_update(
+                {"id": job_id, "status": StatusJob.PENDENTE},
+                {"$set": {
+                    "status": StatusJob.EXECUTANDO,
+                    "started_at": agora,
+                    "executor": EXECUTOR_JOBS,
+                    "concessao_expira_em": agora + timedelta(seconds=JOBS_CONCESSAO_SEGUNDOS)
+                }}
+            )
+            if not doc:
+                continue
+            job = Job(**doc)
+            renovacao = asyncio.create_task(renovar_concessao_job(job.id))
+            try:
+                resultado = await executar_job(job)
+                atualizacao = {"status": StatusJob.CONCLUIDO, "resultado": resultado, "progresso": 1.0}
+            except Exception as e:
+                logger.exception("Job %s falhou", job.id)
+                atualizacao = {"status": StatusJob.FALHOU, "erro": str(e)[:LIMITE_ERRO_JOB]}
+            finally:
+                renovacao.cancel()
+            atualizacao["finished_at"] = datetime.utcnow()
+            atualizacao["concessao_expira_em"] = None
+            # Se a concessão expirou e outro executor assumiu, o resultado dele prevalece
+            try:
+                await db.jobs.update_one({"id": job.id, "executor": EXECUTOR_JOBS}, {"$set": atualizacao})
+            except Exception as e:
+                # Ex.: resultado maior que 16 MB. Sem isso o job ficaria EXECUTANDO e seria
+                # reexecutado a cada expiração da concessão.
+                logger.exception("Não foi possível gravar o resultado do job %s", job.id)
+                await db.jobs.update_one({"id": job.id, "executor": EXECUTOR_JOBS}, {"$set": {
+                    "status": StatusJob.FALHOU,
+                    "erro": f"Falha ao gravar o resultado: {str(e)[:LIMITE_ERRO_JOB]}",
+                    "finished_at": atualizacao["finished_at"],
+                    "concessao_expira_em": None
+                }})
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Erro no worker de jobs")
+        finally:
+            fila_jobs.task_done()
+
+async def recuperar_jobs_expirados():
+    # Só volta para a fila o job cujo executor parou de renovar a concessão
+    # (processo encerrado ou travado); jobs em execução em outro processo ficam onde estão.
+    filtro = {"status": StatusJob.EXECUTANDO, "concessao_expira_em": {"$lt": datetime.utcnow()}}
+    async for doc in db.jobs.find(filtro, {"id": 1}):
+        recuperado = await db.jobs.find_one_and_update(
+            {"id": doc["id"], **filtro},
+            {"$set": {"status": StatusJob.PENDENTE, "progresso": 0, "executor": None, "concessao_expira_em": None}}
+        )
+        if recuperado:
+            logger.warning("Job %s retomado após expirar a concessão de %s", doc["id"], recuperado.get("executor"))
+            fila_jobs.put_nowait(doc["id"])
+
+async def tarefa_recuperacao_jobs():
+    while True:
+        await asyncio.sleep(JOBS_CONCESSAO_SEGUNDOS)
+        try:
+            await recuperar_jobs_expirados()
+        except Exception:
+            logger.exception("Erro ao recuperar jobs com concessão expirada")
+
+async def iniciar_jobs():
+    # Jobs de executores que pararam de renovar a concessão voltam para a fila
+    await db.jobs.update_many(
+        {"status": StatusJob.EXECUTANDO, "concessao_expira_em": None},
+        {"$set": {"concessao_expira_em": datetime.utcnow() + timedelta(seconds=JOBS_CONCESSAO_SEGUNDOS)}}
+    )
+    await recuperar_jobs_expirados()
+    async for doc in db.jobs.find({"status": StatusJob.PENDENTE}, {"id": 1}).sort("created_at", 1):
+        fila_jobs.put_nowait(doc["id"])
+    for _ in range(JOBS_WORKERS):
+        workers_jobs.append(asyncio.create_task(worker_jobs()))
+    workers_jobs.append(asyncio.create_task(tarefa_recuperacao_jobs()))
+
+async def encerrar_jobs():
+    for worker in workers_jobs:
+        worker.cancel()
+    await asyncio.gather(*workers_jobs, return_exceptions=True)
+    workers_jobs.clear()
+    if _pool_processos is not None:
+        _pool_processos.shutdown(wait=False, cancel_futures=True)
+
+async def enfileirar_job(job: Job) -> Job:
+    await db.jobs.insert_one(job.dict())
+    fila_jobs.put_nowait(job.id)
+    return job
+
+@api_router.post("/jobs", response_model=Job)
+async def criar_job(job_create: JobCreate):
+    if job_create.tipo == TipoJob.IMPORTAR_PRODUTOS:
+        raise HTTPException(status_code=400, detail="Envie o arquivo CSV para /api/jobs/importacao")
+    return await enfileirar_job(Job(**job_create.dict()))
+
+@api_router.post("/jobs/importacao", response_model=Job)
+async def criar_job_importacao(arquivo: UploadFile = File(...)):
+    job = Job(tipo=TipoJob.IMPORTAR_PRODUTOS)
+    DIRETORIO_IMPORTACOES.mkdir(parents=True, exist_ok=True)
+    nome = f"{job.id}.csv"
+    # Grava o upload em blocos; o job lê o arquivo do disco em lotes
+    with open(DIRETORIO_IMPORTACOES / nome, "wb") as destino:
+        while True:
+            bloco = await arquivo.read(1024 * 1024)
+            if not bloco:
+                break
+            await asyncio.to_thread(destino.write, bloco)
+    job.parametros = {"arquivo": nome, "nome_original": arquivo.filename}
+    return await enfileirar_job(job)
+
+@api_router.post("/auditoria/estoque", response_model=Job, status_code=202)
+async def executar_auditoria_estoque(paralelismo: int = 4, corrigir: bool = False, limite_divergencias: int = 100):
+    # A varredura do livro inteiro roda na fila de jobs; o resultado sai em GET /api/jobs/{id}
+    return await enfileirar_job(Job(
+        tipo=TipoJob.AUDITAR_ESTOQUE,
+        parametros={"paralelismo": paralelismo, "corrigir": corrigir, "limite_divergencias": limite_divergencias}
+    ))
+
+@api_router.get("/jobs", response_model=List[Job])
+async def listar_jobs(status: Optional[StatusJob] = None, limit: int = 50):
+    filter_dict = {}
+    if status:
+        filter_dict["status"] = status
+    jobs = await db.jobs.find(filter_dict, {"parametros": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+    return [Job(**job) for job in jobs]
+
+@api_router.get("/jobs/{job_id}", response_model=Job)
+async def obter_job(job_id: str):
+    job = await db.jobs.find_one({"id": job_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return Job(**job)
+
+@api_router.get("/jobs/{job_id}/arquivo")
+async def baixar_arquivo_job(job_id: str):
+    job = await db.jobs.find_one({"id": job_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    arquivo = (job.get("resultado") or {}).get("arquivo")
+    if job["status"] != StatusJob.CONCLUIDO or not arquivo:
+        raise HTTPException(status_code=400, detail="Job não possui arquivo disponível")
+    return FileResponse(DIRETORIO_EXPORTACOES / arquivo, media_type="text/csv", filename=arquivo)
+
 # Health check
 @api_router.get("/")
 async def root():
     return {"message": "Sistema de Controle de Estoque - API"}
 
+@api_router.get("/ready")
+async def prontidao():
+    if not getattr(app.state, "pronto", False):
+        return JSONResponse(status_code=503, content={"status": "iniciando"})
+    try:
+        await db.command("ping")
+    except Exception:
+        return JSONResponse(status_code=503, content={"status": "banco indisponível"})
+    return {"status": "pronto"}
+
+# Compressão de respostas
+TAMANHO_MINIMO_COMPRESSAO = 1024
+# Só JSON: arquivos (ex.: CSV dos jobs) saem por FileResponse em fluxo e não devem
+# ser acumulados em memória nem comprimidos no event loop
+TIPOS_COMPRESSIVEIS = ("application/json",)
+
+def negociar_codificacao(accept_encoding: str) -> Optional[str]:
+    aceitas = {}
+    for item in accept_encoding.split(","):
+        partes = [p.strip() for p in item.split(";")]
+        if not partes[0]:
+            continue
+        qualidade = 1.0
+        for parametro in partes[1:]:
+            if parametro.startswith("q="):
+                try:
+                    qualidade = float(parametro[2:])
+                except ValueError:
+                    qualidade = 0.0
+        aceitas[partes[0].lower()] = qualidade
+    if brotli is not None and aceitas.get("br", 0) > 0:
+        return "br"
+    if aceitas.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+def comprimir(corpo: bytes, codificacao: str) -> bytes:
+    if codificacao == "br":
+        return brotli.compress(corpo, quality=5)
+    return gzip.compress(corpo, compresslevel=6)
+
+def marcar_variante(headers: MutableHeaders, codificacao: str):
+    # A ETag identifica a variante pela codificação negociada, não pelo tamanho do corpo,
+    # para que o 304 devolva exatamente a mesma ETag do 200
+    etag = headers.get("etag")
+    if etag and etag.endswith('"'):
+        headers["ETag"] = f'{etag[:-1]}-{codificacao}"'
+    headers.add_vary_header("Accept-Encoding")
+
+class CompressaoMiddleware:
+    """Comprime respostas JSON com brotli ou gzip conforme o Accept-Encoding."""
+
+    def __init__(self, app, tamanho_minimo: int = TAMANHO_MINIMO_COMPRESSAO):
+        self.app = app
+        self.tamanho_minimo = tamanho_minimo
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        codificacao = negociar_codificacao(Headers(scope=scope).get("accept-encoding", ""))
+        if codificacao is None:
+            await self.app(scope, receive, send)
+            return
+
+        inicio = None
+        partes = []
+        direto = False
+
+        async def enviar(mensagem):
+            nonlocal inicio, direto
+            if mensagem["type"] == "http.response.start":
+                headers = Headers(raw=mensagem["headers"])
+                tipo = headers.get("content-type", "")
+                if mensagem["status"] == 304:
+                    marcar_variante(MutableHeaders(raw=mensagem["headers"]), codificacao)
+                direto = (
+                    "content-encoding" in headers
+                    or mensagem["status"] in (204, 304)
+                    or not tipo.startswith(TIPOS_COMPRESSIVEIS)
+                )
+                if direto:
+                    await send(mensagem)
+                else:
+                    inicio = mensagem
+                return
+            if direto or mensagem["type"] != "http.response.body":
+                await send(mensagem)
+                return
+
+            partes.append(mensagem.get("body", b""))
+            if mensagem.get("more_body", False):
+                return
+            corpo = b"".join(partes)
+            headers = MutableHeaders(raw=inicio["headers"])
+            if len(corpo) >= self.tamanho_minimo:
+                corpo = comprimir(corpo, codificacao)
+                headers["Content-Encoding"] = codificacao
+                headers["Content-Length"] = str(len(corpo))
+            marcar_variante(headers, codificacao)
+            await send(inicio)
+            await send({"type": "http.response.body", "body": corpo})
+
+        await self.app(scope, receive, enviar)
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -296,6 +2234,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressaoMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -304,6 +2243,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def criar_indices():
+    await db.produtos.create_index("id")
+    await db.movimentacoes.create_index([("produto_id", 1), ("created_at", 1)])
+    await db.movimentacoes.create_index(ORDEM_AUDITORIA)
+    await db.depositos.create_index("id", unique=True)
+    await db.estoques.create_index([("deposito_id", 1), ("produto_id", 1)], unique=True)
+    await db.movimentacoes.create_index([("deposito_id", 1), ("created_at", 1)], sparse=True)
+    await db.estoque_faixas.create_index([("produto_id", 1), ("faixa", 1)], unique=True)
+    await db.reservas.create_index("id", unique=True)
+    await db.reservas.create_index([("status", 1), ("expira_em", 1)])
+    await db.reservas.create_index("remover_em", expireAfterSeconds=0)
+    await db.historico_precos.create_index([("produto_id", 1), ("vigente_desde", 1)])
+    await db.movimentacoes.create_index([("motivo", 1), ("created_at", 1)])
+    await db.jobs.create_index("id", unique=True)
+    await db.jobs.create_index([("status", 1), ("created_at", 1)])
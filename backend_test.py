@@ -7,6 +7,7 @@ Foca nos endpoints críticos conforme solicitado
 import requests
 import json
 import sys
+import time
 from datetime import datetime
 
 # URL base do backend
@@ -142,6 +143,34 @@ class StockSystemTester:
             self.log_test("Listar Produtos", False, f"Erro: {str(e)}")
             return []
     
+    def test_revalidacao_etag(self):
+        """Teste de cache HTTP: a ETag da resposta comprimida revalida com 304"""
+        try:
+            cabecalhos = {"Accept-Encoding": "gzip"}
+            primeira = self.session.get(f"{self.base_url}/produtos", headers=cabecalhos)
+            etag = primeira.headers.get("ETag")
+            if primeira.status_code != 200 or not etag:
+                self.log_test("Revalidação por ETag", False, f"Status: {primeira.status_code}, ETag: {etag}")
+                return
+            
+            revalidacao = self.session.get(
+                f"{self.base_url}/produtos", headers={**cabecalhos, "If-None-Match": etag}
+            )
+            sucesso = (
+                revalidacao.status_code == 304
+                and revalidacao.headers.get("ETag") == etag
+                and "Accept-Encoding" in revalidacao.headers.get("Vary", "")
+            )
+            self.log_test(
+                "Revalidação por ETag",
+                sucesso,
+                f"ETag {etag} ({primeira.headers.get('Content-Encoding') or 'sem compressão'}), "
+                f"revalidação: {revalidacao.status_code}",
+                None if sucesso else dict(revalidacao.headers)
+            )
+        except Exception as e:
+            self.log_test("Revalidação por ETag", False, f"Erro: {str(e)}")
+    
     def test_busca_produtos(self):
         """Teste de busca por nome e código de barras"""
         # Busca por nome
@@ -488,6 +517,300 @@ class StockSystemTester:
         except Exception as e:
             self.log_test("Desativar Produto", False, f"Erro: {str(e)}")
     
+    def _criar_produto_teste(self, nome, quantidade):
+        """Cria um produto com nome único para os testes de estoque avançados"""
+        produto = {
+            "nome": f"{nome} {datetime.now().strftime('%H%M%S%f')}",
+            "categoria": "Testes",
+            "unidade_medida": "unidade",
+            "quantidade_atual": quantidade,
+            "quantidade_minima": 1,
+            "preco_compra": 2.00,
+            "preco_venda": 3.50
+        }
+        response = self.session.post(f"{self.base_url}/produtos", json=produto)
+        if response.status_code != 200:
+            raise RuntimeError(f"Falha ao criar produto de teste: {response.status_code} {response.text}")
+        return response.json()
+    
+    def _movimentar(self, produto_id, tipo, quantidade, **extras):
+        return self.session.post(
+            f"{self.base_url}/movimentacoes",
+            json={"produto_id": produto_id, "tipo": tipo, "motivo": "venda" if tipo == "saida" else "compra",
+                  "quantidade": quantidade, **extras}
+        )
+    
+    def _quantidade_atual(self, produto_id):
+        return self.session.get(f"{self.base_url}/produtos/{produto_id}").json()["quantidade_atual"]
+    
+    def test_reservas(self):
+        """Teste de reservas: disponível para venda, confirmação e bloqueio de saídas"""
+        try:
+            produto = self._criar_produto_teste("Reserva Teste", 10)
+            response = self.session.post(
+                f"{self.base_url}/reservas",
+                json={"produto_id": produto['id'], "quantidade": 4, "ttl_segundos": 300}
+            )
+            if response.status_code != 200:
+                self.log_test("Reservas", False, f"Criar reserva retornou: {response.status_code}")
+                return
+            reserva = response.json()
+            
+            disponibilidade = self.session.get(f"{self.base_url}/produtos/{produto['id']}/disponibilidade").json()
+            saida_bloqueada = self._movimentar(produto['id'], "saida", 7).status_code == 400
+            ativacao_bloqueada = self.session.post(
+                f"{self.base_url}/produtos/{produto['id']}/contador-distribuido", json={"faixas": 4}
+            ).status_code == 400
+            confirmacao = self.session.post(f"{self.base_url}/reservas/{reserva['id']}/confirmar", json={})
+            
+            # Frações liberadas não podem deixar resíduo de ponto flutuante na quantidade reservada
+            for fracao in (0.1, 0.2):
+                fracionada = self.session.post(
+                    f"{self.base_url}/reservas",
+                    json={"produto_id": produto['id'], "quantidade": fracao, "ttl_segundos": 300}
+                ).json()
+                self.session.post(f"{self.base_url}/reservas/{fracionada['id']}/liberar")
+            final = self.session.get(f"{self.base_url}/produtos/{produto['id']}/disponibilidade").json()
+            
+            sucesso = (
+                reserva["remover_em"] is None
+                and disponibilidade["disponivel"] == 6
+                and saida_bloqueada
+                and ativacao_bloqueada
+                and confirmacao.status_code == 200
+                and confirmacao.json()["motivo"] == "venda"
+                and final["quantidade_atual"] == 6
+                and final["quantidade_reservada"] == 0
+            )
+            self.log_test(
+                "Reservas",
+                sucesso,
+                f"Disponível com reserva: {disponibilidade['disponivel']}, após confirmar: {final['quantidade_atual']}",
+                None if sucesso else {
+                    "saida_bloqueada": saida_bloqueada,
+                    "ativacao_bloqueada": ativacao_bloqueada,
+                    "confirmacao": confirmacao.status_code,
+                    "final": final
+                }
+            )
+        except Exception as e:
+            self.log_test("Reservas", False, f"Erro: {str(e)}")
+    
+    def test_transferencias(self):
+        """Teste de depósitos: entrada por depósito, transferência e saldo insuficiente"""
+        try:
+            produto = self._criar_produto_teste("Transferencia Teste", 0)
+            sufixo = datetime.now().strftime('%H%M%S%f')
+            origem = self.session.post(f"{self.base_url}/depositos", json={"nome": f"Origem {sufixo}"}).json()
+            destino = self.session.post(f"{self.base_url}/depositos", json={"nome": f"Destino {sufixo}"}).json()
+            
+            entrada = self._movimentar(produto['id'], "entrada", 10, deposito_id=origem['id'])
+            transferencia = self.session.post(
+                f"{self.base_url}/transferencias",
+                json={"produto_id": produto['id'], "deposito_origem_id": origem['id'],
+                      "deposito_destino_id": destino['id'], "quantidade": 4}
+            )
+            excedente = self.session.post(
+                f"{self.base_url}/transferencias",
+                json={"produto_id": produto['id'], "deposito_origem_id": origem['id'],
+                      "deposito_destino_id": destino['id'], "quantidade": 100}
+            )
+            negativa = self._movimentar(produto['id'], "entrada", -5, deposito_id=origem['id'])
+            
+            # Com saldo em depósitos a reserva informa o depósito, que é baixado na confirmação
+            sem_deposito = self.session.post(
+                f"{self.base_url}/reservas", json={"produto_id": produto['id'], "quantidade": 1}
+            )
+            reserva = self.session.post(
+                f"{self.base_url}/reservas",
+                json={"produto_id": produto['id'], "quantidade": 2, "deposito_id": origem['id']}
+            ).json()
+            transferencia_reservada = self.session.post(
+                f"{self.base_url}/transferencias",
+                json={"produto_id": produto['id'], "deposito_origem_id": origem['id'],
+                      "deposito_destino_id": destino['id'], "quantidade": 5}
+            )
+            confirmacao = self.session.post(f"{self.base_url}/reservas/{reserva['id']}/confirmar", json={})
+            
+            # O total é a soma dos depósitos: sem deposito_id a saída é recusada, e um produto
+            # com saldo global não passa a usar depósitos
+            global_recusada = self._movimentar(produto['id'], "saida", 1)
+            com_saldo = self._criar_produto_teste("Saldo Global Teste", 3)
+            deposito_recusado = self._movimentar(com_saldo['id'], "entrada", 1, deposito_id=origem['id'])
+            saldos = {
+                d['id']: sum(e['quantidade'] for e in self.session.get(
+                    f"{self.base_url}/depositos/{d['id']}/estoque"
+                ).json() if e['produto_id'] == produto['id'])
+                for d in (origem, destino)
+            }
+            total = self._quantidade_atual(produto['id'])
+            
+            sucesso = (
+                entrada.status_code == 200
+                and transferencia.status_code == 200
+                and len(transferencia.json()) == 2
+                and excedente.status_code == 400
+                and negativa.status_code == 422
+                and sem_deposito.status_code == 400
+                and transferencia_reservada.status_code == 400
+                and global_recusada.status_code == 400
+                and deposito_recusado.status_code == 400
+                and confirmacao.status_code == 200
+                and confirmacao.json()["deposito_id"] == origem['id']
+                and saldos == {origem['id']: 4, destino['id']: 4}
+                and total == 8
+            )
+            self.log_test(
+                "Transferências",
+                sucesso,
+                f"Origem: {saldos[origem['id']]}, destino: {saldos[destino['id']]}, total do produto: {total}",
+                None if sucesso else {
+                    "entrada": entrada.status_code,
+                    "transferencia": transferencia.status_code,
+                    "excedente": excedente.status_code,
+                    "negativa": negativa.status_code,
+                    "sem_deposito": sem_deposito.status_code,
+                    "transferencia_reservada": transferencia_reservada.status_code,
+                    "global_recusada": global_recusada.status_code,
+                    "deposito_recusado": deposito_recusado.status_code,
+                    "confirmacao": confirmacao.status_code
+                }
+            )
+        except Exception as e:
+            self.log_test("Transferências", False, f"Erro: {str(e)}")
+    
+    def test_contador_distribuido(self):
+        """Teste de contador distribuído: saídas entre faixas, concentração e desativação"""
+        try:
+            produto = self._criar_produto_teste("Faixas Teste", 16)
+            ativacao = self.session.post(
+                f"{self.base_url}/produtos/{produto['id']}/contador-distribuido", json={"faixas": 4}
+            )
+            if ativacao.status_code != 200:
+                self.log_test("Contador Distribuído", False, f"Ativação retornou: {ativacao.status_code}")
+                return
+            
+            entrada = self._movimentar(produto['id'], "entrada", 2)
+            # Cada faixa tem cerca de 4 unidades: a saída de 10 obriga a concentrar o saldo
+            saida = self._movimentar(produto['id'], "saida", 10)
+            excedente = self._movimentar(produto['id'], "saida", 100)
+            por_deposito = self._movimentar(produto['id'], "entrada", 1, deposito_id="qualquer")
+            consolidado = self._quantidade_atual(produto['id'])
+            desativacao = self.session.delete(f"{self.base_url}/produtos/{produto['id']}/contador-distribuido")
+            # Reativar reaproveita as faixas fechadas; a auditoria confere as cadeias delas
+            reativacao = self.session.post(
+                f"{self.base_url}/produtos/{produto['id']}/contador-distribuido", json={"faixas": 2}
+            )
+            redesativacao = self.session.delete(f"{self.base_url}/produtos/{produto['id']}/contador-distribuido")
+            
+            sucesso = (
+                entrada.status_code == 200
+                and saida.status_code == 200
+                and excedente.status_code == 400
+                and por_deposito.status_code == 400
+                and consolidado == 8
+                and desativacao.status_code == 200
+                and desativacao.json()["quantidade_atual"] == 8
+                and desativacao.json()["faixas_estoque"] == 0
+                and reativacao.status_code == 200
+                and redesativacao.status_code == 200
+                and redesativacao.json()["quantidade_atual"] == 8
+            )
+            self.log_test(
+                "Contador Distribuído",
+                sucesso,
+                f"Saldo consolidado: {consolidado}, após desativar: {desativacao.json().get('quantidade_atual')}",
+                None if sucesso else {
+                    "entrada": entrada.status_code,
+                    "saida": saida.status_code,
+                    "excedente": excedente.status_code,
+                    "por_deposito": por_deposito.status_code,
+                    "desativacao": desativacao.status_code,
+                    "reativacao": reativacao.status_code,
+                    "redesativacao": redesativacao.status_code
+                }
+            )
+        except Exception as e:
+            self.log_test("Contador Distribuído", False, f"Erro: {str(e)}")
+    
+    def _aguardar_job(self, job, prazo_segundos=60):
+        prazo = time.time() + prazo_segundos
+        while job["status"] in ("pendente", "executando") and time.time() < prazo:
+            time.sleep(1)
+            job = self.session.get(f"{self.base_url}/jobs/{job['id']}").json()
+        return job
+    
+    def test_reajuste_precos(self):
+        """Teste do reajuste em massa de preços e do histórico gerado"""
+        try:
+            produto = self._criar_produto_teste("Reajuste Teste", 5)
+            response = self.session.post(
+                f"{self.base_url}/produtos/reajuste",
+                json={"produto_ids": [produto["id"]], "percentual": 10}
+            )
+            if response.status_code != 200 or response.json()["produtos_atualizados"] != 1:
+                self.log_test("Reajuste de Preços", False, f"Status: {response.status_code}", response.text)
+                return
+            
+            preco_venda = self.session.get(f"{self.base_url}/produtos/{produto['id']}").json()["preco_venda"]
+            historico = self.session.get(f"{self.base_url}/produtos/{produto['id']}/historico-precos").json()
+            reajustes = [h for h in historico if h["origem"] == "reajuste"]
+            self.log_test(
+                "Reajuste de Preços",
+                preco_venda == 3.85 and len(reajustes) == 1 and reajustes[0]["preco_venda"] == 3.85,
+                f"Preço de venda 3.50 → {preco_venda}, {len(reajustes)} registro(s) de reajuste no histórico"
+            )
+        except Exception as e:
+            self.log_test("Reajuste de Preços", False, f"Erro: {str(e)}")
+    
+    def test_relatorio_margens(self):
+        """Teste do relatório de margens (job no pool de processos)"""
+        try:
+            response = self.session.post(
+                f"{self.base_url}/jobs",
+                json={"tipo": "relatorio_margens", "parametros": {"categoria": "Testes", "partes": 4}}
+            )
+            if response.status_code != 200:
+                self.log_test("Relatório de Margens", False, f"Status: {response.status_code}", response.text)
+                return
+            job = self._aguardar_job(response.json())
+            if job["status"] != "concluido":
+                self.log_test("Relatório de Margens", False, f"Job terminou como: {job['status']}", job.get("erro"))
+                return
+            resultado = job["resultado"]
+            arquivo = self.session.get(f"{self.base_url}/jobs/{job['id']}/arquivo")
+            self.log_test(
+                "Relatório de Margens",
+                resultado["resumo"]["vendas"] > 0 and arquivo.status_code == 200
+                and len(resultado["por_produto"]) <= resultado["resumo"]["produtos"],
+                f"{resultado['resumo']['vendas']} vendas, margem {resultado['resumo']['margem']:.2f}, "
+                f"{resultado['resumo']['produtos']} produtos no arquivo"
+            )
+        except Exception as e:
+            self.log_test("Relatório de Margens", False, f"Erro: {str(e)}")
+    
+    def test_auditoria_estoque(self):
+        """Teste da auditoria do livro de movimentações (executada pela fila de jobs)"""
+        try:
+            response = self.session.post(f"{self.base_url}/auditoria/estoque?paralelismo=2")
+            if response.status_code != 202:
+                self.log_test("Auditoria de Estoque", False, f"Status: {response.status_code}")
+                return
+            job = self._aguardar_job(response.json())
+            if job["status"] != "concluido":
+                self.log_test("Auditoria de Estoque", False, f"Job terminou como: {job['status']}", job.get("erro"))
+                return
+            resultado = job["resultado"]
+            self.log_test(
+                "Auditoria de Estoque",
+                resultado["produtos_verificados"] > 0 and resultado["total_divergencias"] == 0,
+                f"{resultado['produtos_verificados']} produtos, {resultado['movimentacoes_verificadas']} movimentações, "
+                f"{resultado['total_divergencias']} divergências",
+                resultado["divergencias"] or None
+            )
+        except Exception as e:
+            self.log_test("Auditoria de Estoque", False, f"Erro: {str(e)}")
+    
     def run_all_tests(self):
         """Executa todos os testes na ordem correta"""
         print("=" * 80)
@@ -504,6 +827,7 @@ class StockSystemTester:
         print("\n📦 TESTANDO CRUD DE PRODUTOS")
         self.test_criar_produtos()
         self.test_listar_produtos()
+        self.test_revalidacao_etag()
         self.test_busca_produtos()
         self.test_filtro_categoria()
         self.test_obter_produto_especifico()
@@ -516,10 +840,22 @@ class StockSystemTester:
         self.test_validacao_estoque_negativo()
         self.test_listar_movimentacoes()
         
+        # Testes de Reservas, Depósitos e Contadores Distribuídos
+        print("\n🏬 TESTANDO RESERVAS, DEPÓSITOS E CONTADORES DISTRIBUÍDOS")
+        self.test_reservas()
+        self.test_transferencias()
+        self.test_contador_distribuido()
+        
+        # Auditoria depois das movimentações acima, que ela precisa conferir
+        print("\n🔍 TESTANDO AUDITORIA DE ESTOQUE")
+        self.test_auditoria_estoque()
+        
         # Testes de Dashboard e Relatórios
         print("\n📈 TESTANDO DASHBOARD E RELATÓRIOS")
         self.test_dashboard()
         self.test_categorias()
+        self.test_reajuste_precos()
+        self.test_relatorio_margens()
         
         # Teste de desativação (por último)
         print("\n🗑️ TESTANDO DESATIVAÇÃO")
@@ -0,0 +1,116 @@
+"""
+Negociação de codificação e compressão de respostas (CompressaoMiddleware)
+
+As requisições são enviadas direto à interface ASGI, sem servidor nem banco.
+"""
+
+import asyncio
+import gzip
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from fastapi import FastAPI, Request, Response  # noqa: E402
+
+import server  # noqa: E402
+
+ETAG = '"7-abc"'
+
+
+def criar_app():
+    app = FastAPI()
+
+    @app.get("/itens")
+    async def itens(request: Request, response: Response):
+        if server.etag_corresponde(request.headers.get("if-none-match"), ETAG):
+            return Response(status_code=304, headers=server.cabecalhos_cache(ETAG))
+        response.headers.update(server.cabecalhos_cache(ETAG))
+        return [{"id": i, "nome": f"Produto {i}"} for i in range(200)]
+
+    @app.get("/pequeno")
+    async def pequeno():
+        return {"ok": True}
+
+    return server.CompressaoMiddleware(app)
+
+
+def requisitar(app, caminho, cabecalhos):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": caminho,
+        "raw_path": caminho.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in cabecalhos.items()],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    mensagens = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(mensagem):
+        mensagens.append(mensagem)
+
+    asyncio.run(app(scope, receive, send))
+    inicio = mensagens[0]
+    headers = {k.decode().lower(): v.decode() for k, v in inicio["headers"]}
+    corpo = b"".join(m.get("body", b"") for m in mensagens[1:])
+    return inicio["status"], headers, corpo
+
+
+def test_negociar_codificacao():
+    assert server.negociar_codificacao("") is None
+    assert server.negociar_codificacao("identity") is None
+    assert server.negociar_codificacao("gzip") == "gzip"
+    assert server.negociar_codificacao("GZIP;q=0.5, deflate") == "gzip"
+    assert server.negociar_codificacao("gzip;q=0") is None
+    assert server.negociar_codificacao("gzip;q=abc") is None
+    esperado_br = "br" if server.brotli is not None else "gzip"
+    assert server.negociar_codificacao("gzip, br") == esperado_br
+    assert server.negociar_codificacao("br;q=0, gzip") == "gzip"
+
+
+def test_resposta_gzip_marca_variante():
+    status, headers, corpo = requisitar(criar_app(), "/itens", {"Accept-Encoding": "gzip"})
+    assert status == 200
+    assert headers["content-encoding"] == "gzip"
+    assert headers["etag"] == '"7-abc-gzip"'
+    assert "Accept-Encoding" in headers["vary"]
+    assert int(headers["content-length"]) == len(corpo)
+    assert len(json.loads(gzip.decompress(corpo))) == 200
+
+
+def test_revalidacao_devolve_304_com_a_mesma_variante():
+    app = criar_app()
+    _, headers, _ = requisitar(app, "/itens", {"Accept-Encoding": "gzip"})
+    status, revalidado, corpo = requisitar(
+        app, "/itens", {"Accept-Encoding": "gzip", "If-None-Match": headers["etag"]}
+    )
+    assert status == 304
+    assert corpo == b""
+    assert revalidado["etag"] == headers["etag"]
+    assert "Accept-Encoding" in revalidado["vary"]
+    assert "content-encoding" not in revalidado
+
+
+def test_sem_compressao():
+    # Sem Accept-Encoding a resposta sai intacta e com a ETag original
+    status, headers, corpo = requisitar(criar_app(), "/itens", {})
+    assert status == 200
+    assert "content-encoding" not in headers
+    assert headers["etag"] == ETAG
+    assert len(json.loads(corpo)) == 200
+
+    # Corpos abaixo do tamanho mínimo não são comprimidos, mas variam pela codificação
+    status, headers, corpo = requisitar(criar_app(), "/pequeno", {"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in headers
+    assert "Accept-Encoding" in headers["vary"]
+    assert json.loads(corpo) == {"ok": True}
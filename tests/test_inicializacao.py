@@ -0,0 +1,30 @@
+"""
+Custo de importação do backend comparado com a linha de base registrada
+
+Para registrar uma nova linha de base: python backend/medir_inicializacao.py --registrar
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from medir_inicializacao import (  # noqa: E402
+    MODULOS_SOB_DEMANDA,
+    carregar_linha_de_base,
+    melhor_medicao,
+    razao_importacao,
+)
+
+
+def test_importacao_nao_carrega_modulos_sob_demanda():
+    modulos = melhor_medicao(1)
+    carregados = [m for m in MODULOS_SOB_DEMANDA if m in modulos]
+    assert carregados == []
+
+
+def test_importacao_dentro_da_linha_de_base():
+    base = carregar_linha_de_base()
+    razao = razao_importacao(melhor_medicao(base["medicoes"]))
+    limite = base["razao_server_fastapi"] * (1 + base["tolerancia"])
+    assert razao <= limite, f"server importa em {razao:.2f}x o tempo do fastapi (limite {limite:.2f}x)"
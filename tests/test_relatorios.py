@@ -0,0 +1,83 @@
+"""
+Relatório de margens: preço vigente por venda (as-of join) e casos de borda
+"""
+
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import relatorios  # noqa: E402
+
+PRODUTOS = [
+    {"id": "a", "nome": "Produto A", "categoria": "X", "preco_compra": 8.0, "preco_venda": 20.0},
+    {"id": "b", "nome": "Produto B", "categoria": "Y", "preco_compra": 3.0, "preco_venda": 5.0},
+]
+
+
+def venda(produto_id, quantidade, quando, preco_unitario=0.0):
+    return {"produto_id": produto_id, "quantidade": quantidade, "preco_unitario": preco_unitario, "created_at": quando}
+
+
+def preco(produto_id, compra, venda_, desde):
+    return {"produto_id": produto_id, "preco_compra": compra, "preco_venda": venda_, "vigente_desde": desde}
+
+
+def test_venda_usa_ultimo_preco_vigente():
+    precos = [
+        preco("a", 4.0, 10.0, datetime(2024, 1, 1)),
+        preco("a", 6.0, 15.0, datetime(2024, 2, 1)),
+    ]
+    movimentacoes = [
+        venda("a", 1, datetime(2024, 1, 15)),
+        venda("a", 2, datetime(2024, 2, 10)),
+    ]
+    resultado = relatorios.margens(movimentacoes, precos, PRODUTOS)
+
+    assert resultado["resumo"]["receita"] == 10.0 + 2 * 15.0
+    assert resultado["resumo"]["custo"] == 4.0 + 2 * 6.0
+    assert [p["periodo"] for p in resultado["por_periodo"]] == ["2024-01-01", "2024-02-01"]
+    assert [p["margem"] for p in resultado["por_periodo"]] == [6.0, 18.0]
+
+
+def test_preco_da_venda_tem_precedencia_sobre_o_historico():
+    precos = [preco("a", 4.0, 10.0, datetime(2024, 1, 1))]
+    resultado = relatorios.margens([venda("a", 1, datetime(2024, 1, 15), preco_unitario=12.0)], precos, PRODUTOS)
+    assert resultado["resumo"]["receita"] == 12.0
+    assert resultado["resumo"]["margem"] == 8.0
+
+
+def test_venda_anterior_ao_historico_usa_preco_atual():
+    precos = [preco("a", 4.0, 10.0, datetime(2024, 3, 1))]
+    movimentacoes = [venda("a", 1, datetime(2024, 1, 15)), venda("b", 2, datetime(2024, 1, 20))]
+    resultado = relatorios.margens(movimentacoes, precos, PRODUTOS)
+
+    por_produto = {p["produto_id"]: p for p in resultado["por_produto"]}
+    assert por_produto["a"]["receita"] == 20.0 and por_produto["a"]["custo"] == 8.0
+    assert por_produto["b"]["receita"] == 10.0 and por_produto["b"]["custo"] == 6.0
+
+
+def test_entradas_vazias():
+    resultado = relatorios.margens([], [], [])
+    assert resultado["resumo"]["vendas"] == 0
+    assert resultado["resumo"]["margem_percentual"] == 0
+    assert resultado["por_periodo"] == []
+    assert resultado["por_produto"] == []
+
+    # Vendas sem histórico de preços
+    resultado = relatorios.margens([venda("b", 1, datetime(2024, 1, 1))], [], PRODUTOS)
+    assert resultado["resumo"]["margem"] == 2.0
+
+
+def test_limite_de_produtos_mantem_totais(tmp_path):
+    movimentacoes = [venda("a", 1, datetime(2024, 1, 1)), venda("b", 1, datetime(2024, 1, 1))]
+    parciais = [relatorios._parciais(relatorios._vendas_com_preco(movimentacoes, [], PRODUTOS, "M"))]
+    caminho = tmp_path / "margens.csv"
+    resultado = relatorios._relatorio(parciais, limite_produtos=1, caminho_produtos=str(caminho))
+
+    assert [p["produto_id"] for p in resultado["por_produto"]] == ["a"]
+    assert resultado["resumo"]["produtos"] == 2
+    assert resultado["resumo"]["margem"] == 12.0 + 2.0
+    assert resultado["arquivo"] == "margens.csv"
+    assert len(caminho.read_text().splitlines()) == 3